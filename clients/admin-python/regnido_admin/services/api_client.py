@@ -1,12 +1,22 @@
 from typing import Any
 
 import httpx
+import orjson
 
 
 class ApiClient:
     def __init__(self) -> None:
         self.base_url = ""
         self.token = ""
+        # Un solo client per sessione: le chiamate successive riusano la connessione keep-alive.
+        self._client = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=16, keepalive_expiry=60.0),
+        )
+
+    def close(self) -> None:
+        self._client.close()
 
     def configure(self, base_url: str, token: str) -> None:
         self.base_url = base_url.rstrip("/")
@@ -17,49 +27,52 @@ class ApiClient:
             return {}
         return {"Authorization": f"Bearer {self.token}"}
 
+    def _post_json(self, url: str, payload: dict[str, Any], headers: dict[str, str] | None = None) -> httpx.Response:
+        return self._client.post(
+            url,
+            content=orjson.dumps(payload),
+            headers={**(headers or {}), "Content-Type": "application/json"},
+        )
+
     def login(self, base_url: str, username: str, password: str) -> str:
         base_url = base_url.rstrip("/")
-        response = httpx.post(
+        response = self._post_json(
             f"{base_url}/auth/login",
-            json={"username": username, "password": password},
-            timeout=10.0,
+            payload={"username": username, "password": password},
         )
         response.raise_for_status()
-        token = response.json()["access_token"]
+        token = orjson.loads(response.content)["access_token"]
         self.configure(base_url, token)
         return token
 
     def create_sede(self, nome: str) -> dict[str, Any]:
-        response = httpx.post(
+        response = self._post_json(
             f"{self.base_url}/admin/sedi",
             headers=self._headers(),
-            json={"nome": nome},
-            timeout=10.0,
+            payload={"nome": nome},
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
     def create_bambino(self, sede_id: str, nome: str, cognome: str, attivo: bool = True) -> dict[str, Any]:
-        response = httpx.post(
+        response = self._post_json(
             f"{self.base_url}/admin/bambini",
             headers=self._headers(),
-            json={"sede_id": sede_id, "nome": nome, "cognome": cognome, "attivo": attivo},
-            timeout=10.0,
+            payload={"sede_id": sede_id, "nome": nome, "cognome": cognome, "attivo": attivo},
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
     def create_device(self, sede_id: str, nome: str, activation_expires_minutes: int = 15) -> dict[str, Any]:
-        response = httpx.post(
+        response = self._post_json(
             f"{self.base_url}/admin/devices",
             headers=self._headers(),
-            json={
+            payload={
                 "sede_id": sede_id,
                 "nome": nome,
                 "attivo": True,
                 "activation_expires_minutes": activation_expires_minutes,
             },
-            timeout=10.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
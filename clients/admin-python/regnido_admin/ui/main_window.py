@@ -1,6 +1,6 @@
-import json
-
 import httpx
+import orjson
+from PySide6.QtGui import QCloseEvent
 from PySide6.QtWidgets import (
     QCheckBox,
     QFormLayout,
@@ -223,11 +223,15 @@ class MainWindow(QMainWindow):
         except httpx.HTTPError as exc:
             self._error(f"Errore rete: {exc}")
 
+    def closeEvent(self, event: QCloseEvent) -> None:
+        self.api.close()
+        super().closeEvent(event)
+
     def _append_output(self, payload: str | dict) -> None:
         if isinstance(payload, str):
             text = payload
         else:
-            text = json.dumps(payload, indent=2, ensure_ascii=False)
+            text = orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
         self.output.append(text)
         self.output.append("-" * 50)
 
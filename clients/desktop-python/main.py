@@ -1,4 +1,7 @@
+import asyncio
+
 from PySide6.QtWidgets import QApplication
+from qasync import QEventLoop
 
 from regnido_client.ui.main_window import MainWindow
 from regnido_client.version import APP_VERSION
@@ -7,9 +10,17 @@ from regnido_client.version import APP_VERSION
 def main() -> int:
     app = QApplication([])
     app.setApplicationName(f"RegNido Desktop v{APP_VERSION}")
+    loop = QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    app_closing = asyncio.Event()
+    app.aboutToQuit.connect(app_closing.set)
+
     window = MainWindow()
     window.show()
-    return app.exec()
+    with loop:
+        loop.run_until_complete(app_closing.wait())
+        loop.run_until_complete(window.aclose())
+    return 0
 
 
 if __name__ == "__main__":
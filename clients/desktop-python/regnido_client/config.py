@@ -4,3 +4,5 @@ from pathlib import Path
 APP_DIR = Path.home() / ".regnido_desktop"
 DB_PATH = APP_DIR / "local.db"
 DEFAULT_API_BASE_URL = "http://localhost:8123"
+# Righe massime tenute nei pannelli di log: una sessione di un'intera giornata non li fa crescere senza limite.
+LOG_MAX_BLOCKS = 2000
@@ -1,24 +1,77 @@
+import asyncio
+from collections import OrderedDict
 from datetime import datetime, timezone
 from email.utils import parsedate_to_datetime
-from time import perf_counter
-from typing import Any
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable, TypeVar
 
 import httpx
+import orjson
 
 from regnido_client.models import Bambino
 
+ETAG_CACHE_SIZE = 16
+RESPONSE_CACHE_TTL_SECONDS = 30.0
+DOWNLOAD_CHUNK_BYTES = 65536
+T = TypeVar("T")
+# Timeout e limiti costruiti una volta: le chiamate senza timeout esplicito usano quello del client
+# e httpx non alloca un nuovo Timeout per richiesta.
+DEFAULT_TIMEOUT = httpx.Timeout(8.0)
+HEALTH_TIMEOUT = httpx.Timeout(4.0)
+HEALTH_HEAD_TIMEOUT = httpx.Timeout(1.5)
+SLOW_TIMEOUT = httpx.Timeout(12.0)
+DOWNLOAD_TIMEOUT = httpx.Timeout(20.0)
+CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=8, max_connections=16, keepalive_expiry=60.0)
+
 
 class ApiClient:
     def __init__(self, base_url: str) -> None:
         self.base_url = base_url.rstrip("/")
         self.token = ""
+        # Client persistente: riusa le connessioni TCP/TLS tra una chiamata e l'altra.
+        # Il pool e' indicizzato per host, quindi un cambio di base_url non richiede un nuovo client.
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=DEFAULT_TIMEOUT,
+            limits=CLIENT_LIMITS,
+        )
+        # Ultime risposte con ETag, per GET condizionali: su 304 si riusa il corpo gia' ricevuto.
+        self._etag_cache: OrderedDict[tuple[str, str], tuple[str, list[dict[str, Any]]]] = OrderedDict()
+        # Risposte lette spesso e di rado modificate (profilo, sedi): scadenza breve e chiamate
+        # concorrenti che condividono la stessa richiesta in corso.
+        self._ttl_cache: dict[tuple[str, str, str], tuple[float, asyncio.Future[Any]]] = {}
+        # URL completi (query inclusa) dell'elenco presenze, per limit: httpx li usa senza ricodificare i parametri.
+        self._presence_urls: dict[int, tuple[httpx.URL, str]] = {}
 
     def set_base_url(self, base_url: str) -> None:
         self.base_url = base_url.rstrip("/")
+        self._presence_urls.clear()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
 
     def set_token(self, token: str) -> None:
         self.token = token
 
+    def invalidate(self, name: str) -> None:
+        for key in [key for key in self._ttl_cache if key[0] == name]:
+            del self._ttl_cache[key]
+
+    async def _cached(self, name: str, fetch: Callable[[], Awaitable[T]]) -> T:
+        key = (name, self.base_url, self.token)
+        entry = self._ttl_cache.get(key)
+        if entry is None or entry[0] < monotonic():
+            entry = (monotonic() + RESPONSE_CACHE_TTL_SECONDS, asyncio.ensure_future(fetch()))
+            self._ttl_cache[key] = entry
+            entry[1].add_done_callback(lambda task, key=key, entry=entry: self._drop_failed(key, entry))
+        return await asyncio.shield(entry[1])
+
+    def _drop_failed(self, key: tuple[str, str, str], entry: tuple[float, asyncio.Future[Any]]) -> None:
+        task = entry[1]
+        if (task.cancelled() or task.exception() is not None) and self._ttl_cache.get(key) is entry:
+            del self._ttl_cache[key]
+
     def _headers(self) -> dict[str, str]:
         headers: dict[str, str] = {}
         if self.token:
@@ -30,21 +83,35 @@ class ApiClient:
             return {}
         return {"Authorization": f"Bearer {token}"}
 
-    def health(self) -> bool:
+    async def _post_json(
+        self,
+        url: str,
+        payload: dict[str, Any],
+        headers: dict[str, str] | None = None,
+        timeout: httpx.Timeout | None = None,
+    ) -> httpx.Response:
+        return await self._client.post(
+            url,
+            content=orjson.dumps(payload),
+            headers={**(headers or {}), "Content-Type": "application/json"},
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        )
+
+    async def health(self) -> bool:
         try:
-            response = httpx.get(f"{self.base_url}/health", timeout=4.0)
+            response = await self._client.get(f"{self.base_url}/health", timeout=HEALTH_TIMEOUT)
             response.raise_for_status()
-            return response.json().get("status") == "ok"
+            return orjson.loads(response.content).get("status") == "ok"
         except httpx.HTTPError:
             return False
 
-    def ping(self) -> dict[str, Any]:
+    async def ping(self) -> dict[str, Any]:
         started = perf_counter()
         try:
-            response = httpx.get(f"{self.base_url}/health", timeout=4.0)
+            response = await self._client.get(f"{self.base_url}/health", timeout=HEALTH_TIMEOUT)
             latency_ms = int((perf_counter() - started) * 1000)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             server_dt_raw = str(data.get("server_time_utc", ""))
             server_dt = datetime.fromisoformat(server_dt_raw.replace("Z", "+00:00")) if server_dt_raw else None
             local_dt = datetime.now(timezone.utc)
@@ -58,10 +125,23 @@ class ApiClient:
             latency_ms = int((perf_counter() - started) * 1000)
             return {"ok": False, "latency_ms": latency_ms, "error": str(exc)}
 
-    def health_details(self) -> dict[str, Any]:
-        response = httpx.get(f"{self.base_url}/health", timeout=4.0)
+    async def health_head(self, timeout: httpx.Timeout = HEALTH_HEAD_TIMEOUT) -> dict[str, Any]:
+        # Solo header e timeout corto: lo skew arriva dall'header Date (al secondo, basta per la soglia).
+        response = await self._client.head(f"{self.base_url}/health", timeout=timeout)
+        date_header = response.headers.get("Date", "")
+        if response.status_code == 405 or (response.is_success and not date_header):
+            return await self.health_details()
+        response.raise_for_status()
+        server_dt = parsedate_to_datetime(date_header)
+        return {
+            "status": "ok",
+            "clock_skew_seconds": int((datetime.now(timezone.utc) - server_dt).total_seconds()),
+        }
+
+    async def health_details(self) -> dict[str, Any]:
+        response = await self._client.get(f"{self.base_url}/health", timeout=HEALTH_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         server_dt_raw = data.get("server_time_utc", "")
         server_dt = datetime.fromisoformat(server_dt_raw.replace("Z", "+00:00")) if server_dt_raw else None
         local_dt = datetime.now(timezone.utc)
@@ -77,191 +157,182 @@ class ApiClient:
             "http_date_utc": parsed_header,
         }
 
-    def login(self, username: str, password: str) -> str:
-        response = httpx.post(
+    async def login(self, username: str, password: str) -> str:
+        response = await self._post_json(
             f"{self.base_url}/auth/login",
-            json={"username": username, "password": password},
-            timeout=8.0,
+            payload={"username": username, "password": password},
         )
         response.raise_for_status()
-        token = response.json()["access_token"]
+        token = orjson.loads(response.content)["access_token"]
         self.set_token(token)
         return token
 
-    def auth_challenge(self, username: str) -> dict[str, Any]:
-        response = httpx.post(
+    async def auth_challenge(self, username: str) -> dict[str, Any]:
+        response = await self._post_json(
             f"{self.base_url}/auth/challenge",
-            json={"username": username},
-            timeout=8.0,
+            payload={"username": username},
         )
         response.raise_for_status()
-        return dict(response.json())
+        return dict(orjson.loads(response.content))
 
-    def auth_challenge_complete(self, challenge_id: str, key_id: str, signature_b64: str) -> str:
-        response = httpx.post(
+    async def auth_challenge_complete(self, challenge_id: str, key_id: str, signature_b64: str) -> str:
+        response = await self._post_json(
             f"{self.base_url}/auth/challenge/complete",
-            json={"challenge_id": challenge_id, "key_id": key_id, "signature_b64": signature_b64},
-            timeout=8.0,
+            payload={"challenge_id": challenge_id, "key_id": key_id, "signature_b64": signature_b64},
         )
         response.raise_for_status()
-        token = response.json()["access_token"]
+        token = orjson.loads(response.content)["access_token"]
         self.set_token(token)
         return token
 
-    def login_no_store(self, username: str, password: str) -> str:
-        response = httpx.post(
+    async def login_no_store(self, username: str, password: str) -> str:
+        response = await self._post_json(
             f"{self.base_url}/auth/login",
-            json={"username": username, "password": password},
-            timeout=8.0,
+            payload={"username": username, "password": password},
         )
         response.raise_for_status()
-        return response.json()["access_token"]
+        return orjson.loads(response.content)["access_token"]
 
-    def auth_me(self) -> dict[str, Any]:
-        response = httpx.get(
+    async def auth_me(self) -> dict[str, Any]:
+        return await self._cached("auth_me", self._fetch_auth_me)
+
+    async def _fetch_auth_me(self) -> dict[str, Any]:
+        response = await self._client.get(
             f"{self.base_url}/auth/me",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def claim_device(self, activation_code: str) -> dict[str, Any]:
-        response = httpx.post(
+    async def claim_device(self, activation_code: str) -> dict[str, Any]:
+        response = await self._post_json(
             f"{self.base_url}/devices/claim",
-            json={"activation_code": activation_code},
-            timeout=8.0,
+            payload={"activation_code": activation_code},
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def register_device(self, client_id: str, nome: str | None = None) -> dict[str, Any]:
+    async def register_device(self, client_id: str, nome: str | None = None) -> dict[str, Any]:
         payload: dict[str, Any] = {"client_id": client_id}
         if nome:
             payload["nome"] = nome
-        response = httpx.post(
+        response = await self._post_json(
             f"{self.base_url}/devices/register",
             headers=self._headers(),
-            json=payload,
-            timeout=8.0,
+            payload=payload,
         )
         response.raise_for_status()
-        return dict(response.json())
+        return dict(orjson.loads(response.content))
 
-    def create_sede(self, nome: str, admin_token: str) -> dict[str, Any]:
-        response = httpx.post(
+    async def create_sede(self, nome: str, admin_token: str) -> dict[str, Any]:
+        response = await self._post_json(
             f"{self.base_url}/admin/sedi",
             headers=self._headers_with_token(admin_token),
-            json={"nome": nome},
-            timeout=8.0,
+            payload={"nome": nome},
         )
         response.raise_for_status()
-        return response.json()
+        self.invalidate("sedi")
+        return orjson.loads(response.content)
 
-    def list_sedi(self, admin_token: str) -> list[dict[str, Any]]:
-        response = httpx.get(
+    async def list_sedi(self, admin_token: str) -> list[dict[str, Any]]:
+        response = await self._client.get(
             f"{self.base_url}/admin/sedi",
             headers=self._headers_with_token(admin_token),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return list(response.json())
+        return list(orjson.loads(response.content))
+
+    async def list_sedi_auth(self) -> list[dict[str, Any]]:
+        return await self._cached("sedi", self._fetch_sedi_auth)
 
-    def list_sedi_auth(self) -> list[dict[str, Any]]:
-        response = httpx.get(
+    async def _fetch_sedi_auth(self) -> list[dict[str, Any]]:
+        response = await self._client.get(
             f"{self.base_url}/admin/sedi",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return list(response.json())
+        return list(orjson.loads(response.content))
 
-    def disable_sede_auth(self, sede_id: str) -> dict[str, Any]:
-        response = httpx.delete(
+    async def disable_sede_auth(self, sede_id: str) -> dict[str, Any]:
+        response = await self._client.delete(
             f"{self.base_url}/admin/sedi/{sede_id}",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return dict(response.json())
+        self.invalidate("sedi")
+        return dict(orjson.loads(response.content))
 
-    def create_bambino(self, sede_id: str, nome: str, cognome: str, admin_token: str, attivo: bool = True) -> dict[str, Any]:
-        response = httpx.post(
+    async def create_bambino(self, sede_id: str, nome: str, cognome: str, admin_token: str, attivo: bool = True) -> dict[str, Any]:
+        response = await self._post_json(
             f"{self.base_url}/admin/bambini",
             headers=self._headers_with_token(admin_token),
-            json={
+            payload={
                 "sede_id": sede_id,
                 "nome": nome,
                 "cognome": cognome,
                 "attivo": attivo,
             },
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def list_bambini_admin(self, sede_id: str | None = None, include_inactive: bool = False) -> list[dict[str, Any]]:
+    async def list_bambini_admin(self, sede_id: str | None = None, include_inactive: bool = False) -> list[dict[str, Any]]:
         params: dict[str, Any] = {"include_inactive": include_inactive}
         if sede_id:
             params["sede_id"] = sede_id
-        response = httpx.get(
+        response = await self._client.get(
             f"{self.base_url}/admin/bambini",
             headers=self._headers(),
             params=params,
-            timeout=8.0,
         )
         response.raise_for_status()
-        return list(response.json())
+        return list(orjson.loads(response.content))
 
-    def create_bambino_admin(self, sede_id: str, nome: str, cognome: str, attivo: bool = True) -> dict[str, Any]:
-        response = httpx.post(
+    async def create_bambino_admin(self, sede_id: str, nome: str, cognome: str, attivo: bool = True) -> dict[str, Any]:
+        response = await self._post_json(
             f"{self.base_url}/admin/bambini",
             headers=self._headers(),
-            json={
+            payload={
                 "sede_id": sede_id,
                 "nome": nome,
                 "cognome": cognome,
                 "attivo": attivo,
             },
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def delete_bambino_admin(self, bambino_id: str) -> dict[str, Any]:
-        response = httpx.delete(
+    async def delete_bambino_admin(self, bambino_id: str) -> dict[str, Any]:
+        response = await self._client.delete(
             f"{self.base_url}/admin/bambini/{bambino_id}",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def create_device(self, sede_id: str, nome: str, admin_token: str, activation_expires_minutes: int = 15) -> dict[str, Any]:
-        response = httpx.post(
+    async def create_device(self, sede_id: str, nome: str, admin_token: str, activation_expires_minutes: int = 15) -> dict[str, Any]:
+        response = await self._post_json(
             f"{self.base_url}/admin/devices",
             headers=self._headers_with_token(admin_token),
-            json={
+            payload={
                 "sede_id": sede_id,
                 "nome": nome,
                 "attivo": True,
                 "activation_expires_minutes": activation_expires_minutes,
             },
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def list_users(self) -> list[dict[str, Any]]:
-        response = httpx.get(
+    async def list_users(self) -> list[dict[str, Any]]:
+        response = await self._client.get(
             f"{self.base_url}/admin/users",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return list(response.json())
+        return list(orjson.loads(response.content))
 
-    def create_user(
+    async def create_user(
         self,
         username: str,
         role: str = "EDUCATORE",
@@ -271,10 +342,10 @@ class ApiClient:
         key_passphrase: str = "",
         key_valid_days: int = 180,
     ) -> dict[str, Any]:
-        response = httpx.post(
+        response = await self._post_json(
             f"{self.base_url}/admin/users",
             headers=self._headers(),
-            json={
+            payload={
                 "username": username,
                 "role": role,
                 "attivo": attivo,
@@ -283,75 +354,85 @@ class ApiClient:
                 "key_passphrase": key_passphrase,
                 "key_valid_days": key_valid_days,
             },
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def token_still_valid(self) -> bool:
+    async def token_still_valid(self) -> bool:
         if not self.token:
             return False
+        # Passa da /auth/me in cache: il refresh post-login riusa la stessa risposta invece di rifare la chiamata.
         try:
-            response = httpx.get(f"{self.base_url}/audit", headers=self._headers(), timeout=8.0)
-            if response.status_code == 401:
-                return False
-            response.raise_for_status()
+            await self.auth_me()
             return True
         except httpx.HTTPError:
             return False
 
-    def get_device(self, device_id: str) -> dict[str, Any]:
-        response = httpx.get(
+    async def get_device(self, device_id: str) -> dict[str, Any]:
+        response = await self._client.get(
             f"{self.base_url}/devices/{device_id}",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def list_bambini(self, dispositivo_id: str, q: str = "", limit: int = 100) -> list[Bambino]:
-        response = httpx.get(
+    async def list_bambini(self, dispositivo_id: str, q: str = "", limit: int = 100) -> list[Bambino]:
+        response = await self._client.get(
             f"{self.base_url}/catalog/bambini",
             params={"dispositivo_id": dispositivo_id, "q": q, "limit": limit},
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return [Bambino(id=row["id"], nome=row["nome"], cognome=row["cognome"]) for row in response.json()]
-
-    def list_bambini_presence_state(self, limit: int = 200) -> list[dict[str, Any]]:
-        response = httpx.get(
-            f"{self.base_url}/catalog/presenze-stato",
-            params={"limit": limit},
-            headers=self._headers(),
-            timeout=8.0,
-        )
+        return [Bambino(id=row["id"], nome=row["nome"], cognome=row["cognome"]) for row in orjson.loads(response.content)]
+
+    async def list_bambini_presence_state(self, limit: int = 200) -> list[dict[str, Any]]:
+        entry = self._presence_urls.get(limit)
+        if entry is None:
+            url = httpx.URL(f"{self.base_url}/catalog/presenze-stato", params={"limit": limit})
+            entry = self._presence_urls[limit] = (url, str(url))
+        return await self._get_list_conditional(*entry)
+
+    async def _get_list_conditional(self, url: httpx.URL, url_key: str) -> list[dict[str, Any]]:
+        cache_key = (url_key, self.token)
+        cached = self._etag_cache.get(cache_key)
+        headers = self._headers()
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        response = await self._client.get(url, headers=headers)
+        if response.status_code == 304 and cached:
+            self._etag_cache.move_to_end(cache_key)
+            return cached[1]
         response.raise_for_status()
-        return list(response.json())
-
-    def list_accessible_sedi(self) -> list[dict[str, Any]]:
-        response = httpx.get(
+        rows = list(orjson.loads(response.content))
+        etag = response.headers.get("ETag")
+        if etag:
+            self._etag_cache[cache_key] = (etag, rows)
+            self._etag_cache.move_to_end(cache_key)
+            while len(self._etag_cache) > ETAG_CACHE_SIZE:
+                self._etag_cache.popitem(last=False)
+        return rows
+
+    async def list_accessible_sedi(self) -> list[dict[str, Any]]:
+        response = await self._client.get(
             f"{self.base_url}/catalog/sedi-accessibili",
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return list(response.json())
+        return list(orjson.loads(response.content))
 
-    def list_accessible_iscritti(self, sede_id: str | None = None, include_inactive: bool = False) -> list[dict[str, Any]]:
+    async def list_accessible_iscritti(self, sede_id: str | None = None, include_inactive: bool = False) -> list[dict[str, Any]]:
         params: dict[str, Any] = {"include_inactive": include_inactive}
         if sede_id:
             params["sede_id"] = sede_id
-        response = httpx.get(
+        response = await self._client.get(
             f"{self.base_url}/catalog/iscritti-accessibili",
             params=params,
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
-        return list(response.json())
+        return list(orjson.loads(response.content))
 
-    def list_presence_history(
+    async def list_presence_history(
         self,
         unita: str,
         periodo: str,
@@ -363,52 +444,64 @@ class ApiClient:
             params["sede_id"] = sede_id
         if bambino_id:
             params["bambino_id"] = bambino_id
-        response = httpx.get(
+        response = await self._client.get(
             f"{self.base_url}/presenze/storico",
             params=params,
             headers=self._headers(),
-            timeout=12.0,
+            timeout=SLOW_TIMEOUT,
         )
         response.raise_for_status()
-        return dict(response.json())
+        return dict(orjson.loads(response.content))
 
-    def export_presence_history_pdf(
+    async def stream_presence_history_pdf(
         self,
+        destination: Path,
         unita: str,
         periodo: str,
         sede_id: str | None = None,
         bambino_id: str | None = None,
-    ) -> bytes:
+    ) -> None:
         params: dict[str, Any] = {"unita": unita, "periodo": periodo}
         if sede_id:
             params["sede_id"] = sede_id
         if bambino_id:
             params["bambino_id"] = bambino_id
-        response = httpx.get(
-            f"{self.base_url}/presenze/storico/export-pdf",
-            params=params,
-            headers=self._headers(),
-            timeout=20.0,
-        )
-        response.raise_for_status()
-        return response.content
-
-    def submit_presence_event(self, endpoint: str, payload: dict[str, str]) -> None:
-        response = httpx.post(
+        # Scarica a blocchi in un file .part e lo rinomina solo a download completo.
+        partial = destination.with_name(f"{destination.name}.part")
+        try:
+            async with self._client.stream(
+                "GET",
+                f"{self.base_url}/presenze/storico/export-pdf",
+                params=params,
+                headers=self._headers(),
+                timeout=DOWNLOAD_TIMEOUT,
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                with partial.open("wb") as fh:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                        fh.write(chunk)
+            partial.replace(destination)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+
+    async def submit_presence_event(self, endpoint: str, payload: dict[str, str]) -> None:
+        response = await self._post_json(
             f"{self.base_url}{endpoint}",
-            json=payload,
+            payload=payload,
             headers=self._headers(),
-            timeout=8.0,
         )
         response.raise_for_status()
 
-    def sync_events(self, events: list[dict[str, str]]) -> dict[str, int]:
-        response = httpx.post(
+    async def sync_events(self, events: list[dict[str, str]]) -> dict[str, int]:
+        response = await self._post_json(
             f"{self.base_url}/sync",
-            json={"eventi": events},
+            payload={"eventi": events},
             headers=self._headers(),
-            timeout=12.0,
+            timeout=SLOW_TIMEOUT,
         )
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         return {"accepted": int(data.get("accepted", 0)), "skipped": int(data.get("skipped", 0))}
@@ -1,6 +1,7 @@
 import base64
 import json
 import uuid
+from functools import lru_cache
 from pathlib import Path
 
 from cryptography.hazmat.primitives import serialization
@@ -8,6 +9,14 @@ from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 
 
 def read_key_file(path: str) -> dict:
+    # mtime e dimensione nella chiave di cache: se il file cambia viene riletto.
+    stat = Path(path).stat()
+    return dict(_read_key_file_cached(path, stat.st_mtime_ns, stat.st_size))
+
+
+# Contiene solo la chiave ancora cifrata con la passphrase, mai quella in chiaro.
+@lru_cache(maxsize=4)
+def _read_key_file_cached(path: str, mtime_ns: int, size: int) -> dict:
     raw = Path(path).read_text(encoding="utf-8")
     payload = json.loads(raw)
     if payload.get("format") != "regnido-key-v1":
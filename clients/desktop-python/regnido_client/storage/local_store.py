@@ -2,13 +2,24 @@ import sqlite3
 from pathlib import Path
 from typing import Any
 
+SYNC_PAYLOAD_FIELDS = ("bambino_id", "dispositivo_id", "client_event_id", "tipo_evento", "timestamp_evento")
+
 
 class LocalStore:
     def __init__(self, db_path: Path) -> None:
         db_path.parent.mkdir(parents=True, exist_ok=True)
-        self._conn = sqlite3.connect(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
         self._conn.row_factory = sqlite3.Row
+        # WAL + synchronous=NORMAL: un fsync per checkpoint invece che per commit.
+        # Una perdita a crash dell'ultimo commit e' accettabile: il server deduplica su client_event_id.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
         self._init_db()
+        # Contatore in memoria degli eventi pending: evita un COUNT(*) dopo ogni azione.
+        self._pending_count = int(self._conn.execute("SELECT COUNT(*) FROM pending_events").fetchone()[0])
+        # Impostazioni gia' lette (None = chiave assente): scritte solo da set_setting, quindi sempre allineate.
+        self._settings_cache: dict[str, str | None] = {}
 
     def _init_db(self) -> None:
         self._conn.execute(
@@ -42,23 +53,40 @@ class LocalStore:
             (key, value),
         )
         self._conn.commit()
+        self._settings_cache[key] = value
 
     def get_setting(self, key: str, default: str = "") -> str:
-        row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        if not row:
-            return default
-        return str(row["value"])
+        if key not in self._settings_cache:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            self._settings_cache[key] = str(row["value"]) if row else None
+        value = self._settings_cache[key]
+        return default if value is None else value
 
-    def enqueue_event(self, event: dict[str, str]) -> None:
-        self._conn.execute(
+    def get_settings(self, defaults: dict[str, str]) -> dict[str, str]:
+        # Piu' impostazioni con una sola SELECT (avvio): le chiavi assenti prendono il default.
+        placeholders = ",".join("?" for _ in defaults)
+        rows = self._conn.execute(
+            f"SELECT key, value FROM settings WHERE key IN ({placeholders})",
+            tuple(defaults),
+        ).fetchall()
+        found = {str(row["key"]): str(row["value"]) for row in rows}
+        for key in defaults:
+            self._settings_cache[key] = found.get(key)
+        return {**defaults, **found}
+
+    def enqueue_event(self, event: dict[str, str], error_message: str | None = None) -> int:
+        # Con error_message l'evento nasce gia' marcato: una sola scrittura/commit invece di due.
+        cursor = self._conn.execute(
             """
             INSERT OR IGNORE INTO pending_events(
                 client_event_id,
                 bambino_id,
                 dispositivo_id,
                 tipo_evento,
-                timestamp_evento
-            ) VALUES (?, ?, ?, ?, ?)
+                timestamp_evento,
+                error_message,
+                last_try_at
+            ) VALUES (?, ?, ?, ?, ?, ?, CASE WHEN ? IS NULL THEN NULL ELSE CURRENT_TIMESTAMP END)
             """,
             (
                 event["client_event_id"],
@@ -66,40 +94,50 @@ class LocalStore:
                 event["dispositivo_id"],
                 event["tipo_evento"],
                 event["timestamp_evento"],
+                error_message[:400] if error_message is not None else None,
+                error_message,
             ),
         )
         self._conn.commit()
+        self._pending_count += cursor.rowcount
+        return self._pending_count
 
-    def list_pending_events(self, limit: int = 200) -> list[dict[str, Any]]:
-        rows = self._conn.execute(
-            """
-            SELECT id, client_event_id, bambino_id, dispositivo_id, tipo_evento, timestamp_evento,
-                   error_message, last_try_at, created_at
+    def list_pending_payloads(self, limit: int = 200) -> list[dict[str, Any]]:
+        # Solo le colonne del payload /sync: le righe si inviano cosi' come sono.
+        # Tuple semplici al posto di sqlite3.Row: ogni riga diventa direttamente il dict da inviare.
+        cursor = self._conn.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(
+            f"""
+            SELECT {", ".join(SYNC_PAYLOAD_FIELDS)}
             FROM pending_events
             ORDER BY id ASC
             LIMIT ?
             """,
             (limit,),
         ).fetchall()
-        return [dict(row) for row in rows]
+        return [dict(zip(SYNC_PAYLOAD_FIELDS, row)) for row in rows]
 
-    def mark_event_error(self, client_event_id: str, error_message: str) -> None:
-        self._conn.execute(
-            "UPDATE pending_events SET error_message = ?, last_try_at = CURRENT_TIMESTAMP WHERE client_event_id = ?",
-            (error_message[:400], client_event_id),
-        )
-        self._conn.commit()
-
-    def remove_events(self, client_event_ids: list[str]) -> None:
-        if not client_event_ids:
-            return
-        placeholders = ",".join("?" for _ in client_event_ids)
-        self._conn.execute(
-            f"DELETE FROM pending_events WHERE client_event_id IN ({placeholders})",
-            tuple(client_event_ids),
-        )
-        self._conn.commit()
+    def apply_sync_result(self, processed_ids: list[str], failed: list[tuple[str, str]]) -> int:
+        # Esito di un intero flush (eventi inviati + errori per evento) in una sola transazione: un commit per ciclo.
+        if not processed_ids and not failed:
+            return self._pending_count
+        removed = 0
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if processed_ids:
+                placeholders = ",".join("?" for _ in processed_ids)
+                removed = self._conn.execute(
+                    f"DELETE FROM pending_events WHERE client_event_id IN ({placeholders})",
+                    tuple(processed_ids),
+                ).rowcount
+            if failed:
+                self._conn.executemany(
+                    "UPDATE pending_events SET error_message = ?, last_try_at = CURRENT_TIMESTAMP WHERE client_event_id = ?",
+                    [(error_message[:400], client_event_id) for error_message, client_event_id in failed],
+                )
+        self._pending_count -= removed
+        return self._pending_count
 
     def count_pending(self) -> int:
-        row = self._conn.execute("SELECT COUNT(*) AS n FROM pending_events").fetchone()
-        return int(row["n"]) if row else 0
+        return self._pending_count
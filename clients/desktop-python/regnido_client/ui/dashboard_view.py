@@ -1,6 +1,9 @@
-from datetime import datetime, timezone
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
 
-from PySide6.QtCore import QDate, QTimer, Signal
+from PySide6.QtCore import QDate, QSignalBlocker, QTimer, Signal
+from PySide6.QtGui import QKeySequence, QShortcut
 from PySide6.QtWidgets import (
     QCheckBox,
     QComboBox,
@@ -12,16 +15,46 @@ from PySide6.QtWidgets import (
     QLineEdit,
     QListWidget,
     QListWidgetItem,
+    QPlainTextEdit,
     QPushButton,
     QSpinBox,
+    QTableView,
     QTableWidget,
     QTableWidgetItem,
     QTabWidget,
-    QTextEdit,
     QVBoxLayout,
     QWidget,
 )
 
+from regnido_client.config import LOG_MAX_BLOCKS
+from regnido_client.ui.presence_table import (
+    ENTER_COLUMN,
+    EXIT_COLUMN,
+    PresenceButtonDelegate,
+    PresenceRow,
+    PresenceTableModel,
+)
+
+_USER_LABEL = "{username}: {role} | {groups} | {sede} | {stato}"
+_ISCRITTO_LABEL = "{cognome} {nome} | {sede_nome} | {stato}"
+_TWO_DIGITS = tuple(f"{i:02d}" for i in range(100))
+
+
+@contextmanager
+def _bulk_update(view: QTableView | QListWidget) -> Iterator[None]:
+    # Un solo repaint a fine popolamento invece di uno per ogni riga inserita.
+    sorting = view.isSortingEnabled()
+    view.setUpdatesEnabled(False)
+    if sorting:
+        view.setSortingEnabled(False)
+    try:
+        yield
+    finally:
+        if sorting:
+            view.setSortingEnabled(True)
+        view.setUpdatesEnabled(True)
+        view.viewport().update()
+
 
 class DashboardView(QWidget):
     check_in_requested = Signal(str)
@@ -44,7 +77,6 @@ class DashboardView(QWidget):
 
     def __init__(self) -> None:
         super().__init__()
-        self._presence_rows: dict[str, dict] = {}
         self._presenze_tab_index = -1
         self._storico_tab_index = -1
         self._user_tab_index = -1
@@ -54,13 +86,31 @@ class DashboardView(QWidget):
         self.connection_label = QLabel("Stato rete: -")
         self.device_label = QLabel("Dispositivo: -")
         self.pending_label = QLabel("Pending sync: 0")
-
-        self.presenze_table = QTableWidget()
-        self.presenze_table.setColumnCount(6)
-        self.presenze_table.setHorizontalHeaderLabels(["Bambino", "Ingresso", "Uscita", "Tempo totale", "Entra", "Esce"])
+        self._last_connection_status: tuple[str, bool] | None = None
+        self._last_pending_count = 0
+        # Etichette dei filtri storico per id: lookup diretto invece di findData sul modello della combo.
+        self.history_sede_labels: dict[str, str] = {}
+        self.history_iscritto_labels: dict[str, str] = {}
+
+        # Filtro locale sulle righe gia' caricate: nessuna chiamata al backend mentre si digita.
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Cerca bambino (Ctrl+F)")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_input.textChanged.connect(self._apply_presence_filter)
+        QShortcut(QKeySequence.Find, self, activated=self.search_input.setFocus)
+
+        self.presence_model = PresenceTableModel(self._format_duration, self)
+        self.presenze_table = QTableView()
+        self.presenze_table.setModel(self.presence_model)
         self.presenze_table.verticalHeader().setVisible(False)
-        self.presenze_table.setSelectionMode(QTableWidget.NoSelection)
-        self.presenze_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.presenze_table.setSelectionMode(QTableView.NoSelection)
+        self.presenze_table.setEditTriggers(QTableView.NoEditTriggers)
+        self._enter_delegate = PresenceButtonDelegate(self.presenze_table)
+        self._exit_delegate = PresenceButtonDelegate(self.presenze_table)
+        self._enter_delegate.clicked.connect(self.check_in_requested.emit)
+        self._exit_delegate.clicked.connect(self.check_out_requested.emit)
+        self.presenze_table.setItemDelegateForColumn(ENTER_COLUMN, self._enter_delegate)
+        self.presenze_table.setItemDelegateForColumn(EXIT_COLUMN, self._exit_delegate)
 
         self.sync_button = QPushButton("Sincronizza ora")
         self.settings_button = QPushButton("Impostazioni")
@@ -87,6 +137,7 @@ class DashboardView(QWidget):
 
         body = QHBoxLayout()
         left = QVBoxLayout()
+        left.addWidget(self.search_input)
         left.addWidget(self.presenze_table)
         body.addLayout(left, 2)
         body.addLayout(actions, 1)
@@ -97,6 +148,81 @@ class DashboardView(QWidget):
         presenze_tab = QWidget()
         presenze_tab.setLayout(presenze_root)
 
+        self.history_unit_combo = QComboBox()
+        self.history_unit_combo.addItem("Giorno", "giorno")
+        self.history_unit_combo.addItem("Mese", "mese")
+        self.history_day_input = QDateEdit()
+        self.history_day_input.setCalendarPopup(True)
+        self.history_day_input.setDate(QDate.currentDate())
+        self.history_month_input = QDateEdit()
+        self.history_month_input.setCalendarPopup(True)
+        self.history_month_input.setDisplayFormat("yyyy-MM")
+        self.history_month_input.setDate(QDate.currentDate())
+        self.history_sede_combo = QComboBox()
+        self.history_iscritto_combo = QComboBox()
+        self.refresh_history_button = QPushButton("Aggiorna storico")
+        self.export_history_button = QPushButton("Esporta PDF")
+        self.history_status = QPlainTextEdit()
+        self.history_status.setReadOnly(True)
+        self.history_status.setMaximumBlockCount(LOG_MAX_BLOCKS)
+        self.history_status.setMaximumHeight(140)
+        self.history_table = QTableWidget()
+        self.history_table.setColumnCount(5)
+        self.history_table.setHorizontalHeaderLabels(["Iscritto", "Sede", "Ingresso", "Uscita", "Tempo totale"])
+        self.history_table.verticalHeader().setVisible(False)
+        self.history_table.setSelectionMode(QTableWidget.NoSelection)
+        self.history_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.history_unit_combo.currentIndexChanged.connect(self._toggle_history_period_inputs)
+        self.history_sede_combo.currentIndexChanged.connect(self._emit_history_sede_changed)
+        self.refresh_history_button.clicked.connect(self._emit_refresh_history)
+        self.export_history_button.clicked.connect(self._emit_export_history)
+
+        history_filters = QHBoxLayout()
+        history_filters.addWidget(QLabel("Unità"))
+        history_filters.addWidget(self.history_unit_combo)
+        history_filters.addWidget(QLabel("Giorno"))
+        history_filters.addWidget(self.history_day_input)
+        history_filters.addWidget(QLabel("Mese"))
+        history_filters.addWidget(self.history_month_input)
+        history_filters.addWidget(QLabel("Sede"))
+        history_filters.addWidget(self.history_sede_combo)
+        history_filters.addWidget(QLabel("Iscritto"))
+        history_filters.addWidget(self.history_iscritto_combo)
+        history_filters.addStretch(1)
+        history_filters.addWidget(self.refresh_history_button)
+        history_filters.addWidget(self.export_history_button)
+
+        history_root = QVBoxLayout()
+        history_top = QHBoxLayout()
+        history_top.addWidget(QLabel("Storico presenze"))
+        history_top.addStretch(1)
+        history_home_button = QPushButton("Home Presenze")
+        history_home_button.clicked.connect(lambda: self.go_to_section("presenze"))
+        history_top.addWidget(history_home_button)
+        history_root.addLayout(history_top)
+        history_root.addLayout(history_filters)
+        history_root.addWidget(self.history_table)
+        history_root.addWidget(self.history_status)
+        history_tab = QWidget()
+        history_tab.setLayout(history_root)
+
+        self.tabs = QTabWidget()
+        self._presenze_tab_index = self.tabs.addTab(presenze_tab, "Presenze")
+        self._storico_tab_index = self.tabs.addTab(history_tab, "Storico")
+        self.tabs.tabBar().hide()
+
+        root = QVBoxLayout()
+        root.addWidget(self.tabs)
+        self.setLayout(root)
+
+        self._presence_timer = QTimer(self)
+        self._presence_timer.setInterval(1000)
+        self._presence_timer.timeout.connect(self._update_presence_timers)
+        self._presence_timer.start()
+        self._toggle_history_period_inputs()
+
+    def _build_users_tab(self) -> QWidget:
         self.users_list_widget = QListWidget()
         self.user_username_input = QLineEdit()
         self.user_sede_combo = QComboBox()
@@ -114,8 +240,9 @@ class DashboardView(QWidget):
         self.user_active_checkbox.setChecked(True)
         self.create_user_button = QPushButton("Crea utente")
         self.refresh_users_button = QPushButton("Aggiorna elenco")
-        self.users_status = QTextEdit()
+        self.users_status = QPlainTextEdit()
         self.users_status.setReadOnly(True)
+        self.users_status.setMaximumBlockCount(LOG_MAX_BLOCKS)
         self.users_status.setMaximumHeight(160)
 
         self.refresh_users_button.clicked.connect(self.refresh_users_requested)
@@ -152,9 +279,11 @@ class DashboardView(QWidget):
         users_root.addWidget(self.users_list_widget)
         users_root.addWidget(user_form_group)
         users_root.addWidget(self.users_status)
-        users_tab = QWidget()
-        users_tab.setLayout(users_root)
+        tab = QWidget()
+        tab.setLayout(users_root)
+        return tab
 
+    def _build_iscritti_tab(self) -> QWidget:
         self.iscritti_list_widget = QListWidget()
         self.iscritti_sede_filter_combo = QComboBox()
         self.iscritti_include_inactive_checkbox = QCheckBox("Mostra disattivi")
@@ -166,8 +295,9 @@ class DashboardView(QWidget):
         self.iscritto_attivo_checkbox.setChecked(True)
         self.create_iscritto_button = QPushButton("Aggiungi iscritto")
         self.delete_iscritto_button = QPushButton("Elimina selezionato")
-        self.iscritti_status = QTextEdit()
+        self.iscritti_status = QPlainTextEdit()
         self.iscritti_status.setReadOnly(True)
+        self.iscritti_status.setMaximumBlockCount(LOG_MAX_BLOCKS)
         self.iscritti_status.setMaximumHeight(160)
 
         self.refresh_iscritti_button.clicked.connect(self._emit_refresh_iscritti)
@@ -210,16 +340,19 @@ class DashboardView(QWidget):
         iscritti_root.addWidget(self.iscritti_list_widget)
         iscritti_root.addWidget(iscritti_form_group)
         iscritti_root.addWidget(self.iscritti_status)
-        iscritti_tab = QWidget()
-        iscritti_tab.setLayout(iscritti_root)
+        tab = QWidget()
+        tab.setLayout(iscritti_root)
+        return tab
 
+    def _build_sedi_tab(self) -> QWidget:
         self.sedi_list_widget = QListWidget()
         self.sedi_nome_input = QLineEdit()
         self.refresh_sedi_button = QPushButton("Aggiorna sedi")
         self.create_sede_button = QPushButton("Crea sede")
         self.disable_sede_button = QPushButton("Disattiva selezionata")
-        self.sedi_status = QTextEdit()
+        self.sedi_status = QPlainTextEdit()
         self.sedi_status.setReadOnly(True)
+        self.sedi_status.setMaximumBlockCount(LOG_MAX_BLOCKS)
         self.sedi_status.setMaximumHeight(160)
 
         self.refresh_sedi_button.clicked.connect(self.refresh_sedi_requested)
@@ -247,159 +380,37 @@ class DashboardView(QWidget):
         sedi_root.addLayout(sedi_actions)
         sedi_root.addWidget(self.sedi_list_widget)
         sedi_root.addWidget(self.sedi_status)
-        sedi_tab = QWidget()
-        sedi_tab.setLayout(sedi_root)
-
-        self.history_unit_combo = QComboBox()
-        self.history_unit_combo.addItem("Giorno", "giorno")
-        self.history_unit_combo.addItem("Mese", "mese")
-        self.history_day_input = QDateEdit()
-        self.history_day_input.setCalendarPopup(True)
-        self.history_day_input.setDate(QDate.currentDate())
-        self.history_month_input = QDateEdit()
-        self.history_month_input.setCalendarPopup(True)
-        self.history_month_input.setDisplayFormat("yyyy-MM")
-        self.history_month_input.setDate(QDate.currentDate())
-        self.history_sede_combo = QComboBox()
-        self.history_iscritto_combo = QComboBox()
-        self.refresh_history_button = QPushButton("Aggiorna storico")
-        self.export_history_button = QPushButton("Esporta PDF")
-        self.history_status = QTextEdit()
-        self.history_status.setReadOnly(True)
-        self.history_status.setMaximumHeight(140)
-        self.history_table = QTableWidget()
-        self.history_table.setColumnCount(5)
-        self.history_table.setHorizontalHeaderLabels(["Iscritto", "Sede", "Ingresso", "Uscita", "Tempo totale"])
-        self.history_table.verticalHeader().setVisible(False)
-        self.history_table.setSelectionMode(QTableWidget.NoSelection)
-        self.history_table.setEditTriggers(QTableWidget.NoEditTriggers)
-
-        self.history_unit_combo.currentIndexChanged.connect(self._toggle_history_period_inputs)
-        self.history_sede_combo.currentIndexChanged.connect(self._emit_history_sede_changed)
-        self.refresh_history_button.clicked.connect(self._emit_refresh_history)
-        self.export_history_button.clicked.connect(self._emit_export_history)
-
-        history_filters = QHBoxLayout()
-        history_filters.addWidget(QLabel("Unità"))
-        history_filters.addWidget(self.history_unit_combo)
-        history_filters.addWidget(QLabel("Giorno"))
-        history_filters.addWidget(self.history_day_input)
-        history_filters.addWidget(QLabel("Mese"))
-        history_filters.addWidget(self.history_month_input)
-        history_filters.addWidget(QLabel("Sede"))
-        history_filters.addWidget(self.history_sede_combo)
-        history_filters.addWidget(QLabel("Iscritto"))
-        history_filters.addWidget(self.history_iscritto_combo)
-        history_filters.addStretch(1)
-        history_filters.addWidget(self.refresh_history_button)
-        history_filters.addWidget(self.export_history_button)
-
-        history_root = QVBoxLayout()
-        history_top = QHBoxLayout()
-        history_top.addWidget(QLabel("Storico presenze"))
-        history_top.addStretch(1)
-        history_home_button = QPushButton("Home Presenze")
-        history_home_button.clicked.connect(lambda: self.go_to_section("presenze"))
-        history_top.addWidget(history_home_button)
-        history_root.addLayout(history_top)
-        history_root.addLayout(history_filters)
-        history_root.addWidget(self.history_table)
-        history_root.addWidget(self.history_status)
-        history_tab = QWidget()
-        history_tab.setLayout(history_root)
-
-        self.tabs = QTabWidget()
-        self._presenze_tab_index = self.tabs.addTab(presenze_tab, "Presenze")
-        self._storico_tab_index = self.tabs.addTab(history_tab, "Storico")
-        self._user_tab_index = self.tabs.addTab(users_tab, "Gestione utenti")
-        self._iscritti_tab_index = self.tabs.addTab(iscritti_tab, "Iscritti")
-        self._sedi_tab_index = self.tabs.addTab(sedi_tab, "Sedi")
-        self.tabs.setTabVisible(self._user_tab_index, False)
-        self.tabs.setTabVisible(self._iscritti_tab_index, False)
-        self.tabs.setTabVisible(self._sedi_tab_index, False)
-        self.tabs.tabBar().hide()
-
-        root = QVBoxLayout()
-        root.addWidget(self.tabs)
-        self.setLayout(root)
-
-        self._presence_timer = QTimer(self)
-        self._presence_timer.setInterval(1000)
-        self._presence_timer.timeout.connect(self._update_presence_timers)
-        self._presence_timer.start()
-        self._toggle_history_period_inputs()
+        tab = QWidget()
+        tab.setLayout(sedi_root)
+        return tab
 
     def set_presence_rows(self, rows: list[dict]) -> None:
-        self._presence_rows = {}
-        self.presenze_table.setRowCount(len(rows))
-        for idx, row in enumerate(rows):
-            bambino_id = str(row.get("id", ""))
-            nome = str(row.get("nome", ""))
-            cognome = str(row.get("cognome", ""))
-            dentro = bool(row.get("dentro"))
-            start_raw = row.get("entrata_aperta_da")
-            start_dt = None
-            if isinstance(start_raw, str) and start_raw:
-                try:
-                    start_dt = datetime.fromisoformat(start_raw.replace("Z", "+00:00"))
-                except ValueError:
-                    start_dt = None
-            ingresso_dt = self._parse_iso_dt(row.get("ultimo_ingresso"))
-            uscita_dt = self._parse_iso_dt(row.get("ultima_uscita"))
-            closed_seconds = max(0, int(row.get("tempo_totale_secondi", 0) or 0))
-
-            display_name = f"{cognome} {nome}".strip()
-            self.presenze_table.setItem(idx, 0, QTableWidgetItem(display_name))
-            self.presenze_table.setItem(idx, 1, QTableWidgetItem(self._format_datetime(ingresso_dt)))
-            self.presenze_table.setItem(idx, 2, QTableWidgetItem(self._format_datetime(uscita_dt)))
-
-            total_label = QLabel(self._format_duration(closed_seconds))
-            self.presenze_table.setCellWidget(idx, 3, total_label)
-
-            enter_button = QPushButton("Entra")
-            exit_button = QPushButton("Esce")
-            enter_button.clicked.connect(lambda _=False, b_id=bambino_id: self.check_in_requested.emit(b_id))
-            exit_button.clicked.connect(lambda _=False, b_id=bambino_id: self.check_out_requested.emit(b_id))
-            self.presenze_table.setCellWidget(idx, 4, enter_button)
-            self.presenze_table.setCellWidget(idx, 5, exit_button)
-
-            self._presence_rows[bambino_id] = {
-                "row": idx,
-                "display_name": display_name.lower(),
-                "dentro": dentro,
-                "start_dt": start_dt,
-                "closed_seconds": closed_seconds,
-                "total_label": total_label,
-                "enter_button": enter_button,
-                "exit_button": exit_button,
-            }
-
-        self._update_presence_timers()
-        self._show_all_presence_rows()
+        records: list[PresenceRow] = []
+        for row in rows:
+            display_name = f"{row.get('cognome', '')} {row.get('nome', '')}".strip()
+            records.append(
+                PresenceRow(
+                    bambino_id=str(row.get("id", "")),
+                    display_name=display_name,
+                    search_key=display_name.lower(),
+                    ingresso=self._format_datetime(self._parse_iso_dt(row.get("ultimo_ingresso"))),
+                    uscita=self._format_datetime(self._parse_iso_dt(row.get("ultima_uscita"))),
+                    dentro=bool(row.get("dentro")),
+                    start_dt=self._parse_iso_dt(row.get("entrata_aperta_da")),
+                    closed_seconds=max(0, int(row.get("tempo_totale_secondi", 0) or 0)),
+                )
+            )
+        self.presence_model.update(records)
+        self._apply_presence_filter(self.search_input.text())
 
     def _update_presence_timers(self) -> None:
-        now = datetime.now(timezone.utc)
-        for data in self._presence_rows.values():
-            dentro = bool(data["dentro"])
-            start_dt = data["start_dt"]
-            closed_seconds = int(data["closed_seconds"])
-            total_label: QLabel = data["total_label"]
-            enter_button: QPushButton = data["enter_button"]
-            exit_button: QPushButton = data["exit_button"]
-
-            if dentro and isinstance(start_dt, datetime):
-                elapsed_live = max(0, int((now - start_dt).total_seconds()))
-                total_label.setText(self._format_duration(closed_seconds + elapsed_live))
-            else:
-                total_label.setText(self._format_duration(closed_seconds))
-
-            enter_button.setEnabled(not dentro)
-            exit_button.setEnabled(dentro)
-
-    def _show_all_presence_rows(self) -> None:
-        for data in self._presence_rows.values():
-            row_idx = int(data["row"])
-            self.presenze_table.setRowHidden(row_idx, False)
+        self.presence_model.tick()
+
+    def _apply_presence_filter(self, text: str) -> None:
+        query = text.strip().lower()
+        with _bulk_update(self.presenze_table):
+            for idx, row in enumerate(self.presence_model.rows()):
+                self.presenze_table.setRowHidden(idx, query not in row.search_key)
 
     def _parse_iso_dt(self, value: object) -> datetime | None:
         if isinstance(value, str) and value:
@@ -415,11 +426,11 @@ class DashboardView(QWidget):
         return value.astimezone().strftime("%d/%m/%Y %H:%M")
 
     def _format_duration(self, seconds: int) -> str:
-        total = max(0, int(seconds))
-        h = total // 3600
-        m = (total % 3600) // 60
-        s = total % 60
-        return f"{h:02d}:{m:02d}:{s:02d}"
+        h, rem = divmod(max(0, int(seconds)), 3600)
+        m, s = divmod(rem, 60)
+        if h < 100:
+            return f"{_TWO_DIGITS[h]}:{_TWO_DIGITS[m]}:{_TWO_DIGITS[s]}"
+        return f"{h}:{_TWO_DIGITS[m]}:{_TWO_DIGITS[s]}"
 
     def _toggle_history_period_inputs(self) -> None:
         is_day = str(self.history_unit_combo.currentData()) == "giorno"
@@ -427,18 +438,23 @@ class DashboardView(QWidget):
         self.history_month_input.setEnabled(not is_day)
 
     def set_history_sedi(self, sedi: list[tuple[str, str]]) -> None:
-        self.history_sede_combo.clear()
-        self.history_sede_combo.addItem("Tutte le sedi", "")
-        for sede_id, sede_nome in sedi:
-            self.history_sede_combo.addItem(f"{sede_nome} ({sede_id[:8]})", sede_id)
+        self.history_sede_labels = dict(sedi)
+        # Segnali bloccati: il riempimento non deve rilanciare il caricamento iscritti.
+        self._fill_combo(
+            self.history_sede_combo,
+            ["Tutte le sedi", *(f"{nome} ({sede_id[:8]})" for sede_id, nome in self.history_sede_labels.items())],
+            ["", *self.history_sede_labels],
+        )
 
     def set_history_iscritti(self, iscritti: list[dict[str, str]]) -> None:
-        self.history_iscritto_combo.clear()
-        self.history_iscritto_combo.addItem("Tutti gli iscritti", "")
-        for row in iscritti:
-            bambino_id = str(row.get("id", ""))
-            label = f"{row.get('cognome', '-')} {row.get('nome', '-')}"
-            self.history_iscritto_combo.addItem(label, bambino_id)
+        self.history_iscritto_labels = {
+            str(row.get("id", "")): f"{row.get('cognome', '-')} {row.get('nome', '-')}" for row in iscritti
+        }
+        self._fill_combo(
+            self.history_iscritto_combo,
+            ["Tutti gli iscritti", *self.history_iscritto_labels.values()],
+            ["", *self.history_iscritto_labels],
+        )
 
     def set_history_rows(self, rows: list[dict[str, object]]) -> None:
         self.history_table.setRowCount(len(rows))
@@ -455,7 +471,7 @@ class DashboardView(QWidget):
             self.history_table.setItem(idx, 4, QTableWidgetItem(totale))
 
     def append_history_status(self, message: str) -> None:
-        self.history_status.append(message)
+        self.history_status.appendPlainText(message)
 
     def history_filters(self) -> tuple[str, str, str, str]:
         unita = str(self.history_unit_combo.currentData())
@@ -477,6 +493,10 @@ class DashboardView(QWidget):
         self.history_sede_changed.emit(str(self.history_sede_combo.currentData() or ""))
 
     def set_connection_status(self, message: str, ok: bool) -> None:
+        # Stesso stato gia' mostrato: niente restyle/repaint della label.
+        if (message, ok) == self._last_connection_status:
+            return
+        self._last_connection_status = (message, ok)
         color = "#1e6a2f" if ok else "#b00020"
         self.connection_label.setStyleSheet(f"color: {color};")
         self.connection_label.setText(f"Stato rete: {message}")
@@ -485,11 +505,19 @@ class DashboardView(QWidget):
         self.device_label.setText(f"Dispositivo: {label}")
 
     def set_pending_count(self, count: int) -> None:
+        if count == self._last_pending_count:
+            return
+        self._last_pending_count = count
         self.pending_label.setText(f"Pending sync: {count}")
 
     def set_admin_tabs_visible(self, visible: bool) -> None:
         if self._user_tab_index < 0:
-            return
+            if not visible:
+                return
+            # Le schede amministrative vengono costruite solo al primo accesso di un admin.
+            self._user_tab_index = self.tabs.addTab(self._build_users_tab(), "Gestione utenti")
+            self._iscritti_tab_index = self.tabs.addTab(self._build_iscritti_tab(), "Iscritti")
+            self._sedi_tab_index = self.tabs.addTab(self._build_sedi_tab(), "Sedi")
         self.tabs.setTabVisible(self._user_tab_index, visible)
         if self._iscritti_tab_index >= 0:
             self.tabs.setTabVisible(self._iscritti_tab_index, visible)
@@ -522,20 +550,25 @@ class DashboardView(QWidget):
         self.tabs.setCurrentIndex(self._presenze_tab_index)
 
     def set_users(self, users: list[dict[str, str]]) -> None:
-        self.users_list_widget.clear()
-        for user in users:
-            groups = ", ".join(user.get("groups", []))
-            stato = "attivo" if user.get("attivo") else "disattivo"
-            role = user.get("role", "-")
-            sede_id = str(user.get("sede_id") or "")
-            sede_label = sede_id[:8] if sede_id else "nessuna sede"
-            label = f"{user.get('username', '-')}: {role} | {groups} | {sede_label} | {stato}"
-            item = QListWidgetItem(label)
-            item.setData(1, user.get("id", ""))
-            self.users_list_widget.addItem(item)
+        with _bulk_update(self.users_list_widget):
+            self.users_list_widget.clear()
+            add_item = self.users_list_widget.addItem
+            for user in users:
+                get = user.get
+                sede_id = str(get("sede_id") or "")
+                label = _USER_LABEL.format(
+                    username=get("username", "-"),
+                    role=get("role", "-"),
+                    groups=", ".join(get("groups", [])),
+                    sede=sede_id[:8] if sede_id else "nessuna sede",
+                    stato="attivo" if get("attivo") else "disattivo",
+                )
+                item = QListWidgetItem(label)
+                item.setData(1, get("id", ""))
+                add_item(item)
 
     def append_users_status(self, message: str) -> None:
-        self.users_status.append(message)
+        self.users_status.appendPlainText(message)
 
     def clear_user_form(self) -> None:
         self.user_username_input.clear()
@@ -564,27 +597,37 @@ class DashboardView(QWidget):
             self.user_sede_combo.addItem(f"{sede_nome} ({sede_id[:8]})", sede_id)
 
     def set_sedi_for_iscritti(self, sedi: list[tuple[str, str]]) -> None:
-        self.iscritti_sede_filter_combo.clear()
-        self.iscritti_sede_filter_combo.addItem("Tutte le sedi", "")
-        self.iscritto_sede_combo.clear()
-        for sede_id, sede_nome in sedi:
-            label = f"{sede_nome} ({sede_id[:8]})"
-            self.iscritti_sede_filter_combo.addItem(label, sede_id)
-            self.iscritto_sede_combo.addItem(label, sede_id)
+        labels = [f"{sede_nome} ({sede_id[:8]})" for sede_id, sede_nome in sedi]
+        sede_ids = [sede_id for sede_id, _ in sedi]
+        self._fill_combo(self.iscritti_sede_filter_combo, ["Tutte le sedi", *labels], ["", *sede_ids])
+        self._fill_combo(self.iscritto_sede_combo, labels, sede_ids)
+
+    def _fill_combo(self, combo: QComboBox, labels: list[str], values: list[str]) -> None:
+        with QSignalBlocker(combo):
+            combo.clear()
+            combo.addItems(labels)
+            for idx, value in enumerate(values):
+                combo.setItemData(idx, value)
 
     def set_iscritti(self, iscritti: list[dict[str, str]], sedi_map: dict[str, str]) -> None:
-        self.iscritti_list_widget.clear()
-        for iscritto in iscritti:
-            sede_id = str(iscritto.get("sede_id", ""))
-            sede_nome = sedi_map.get(sede_id, sede_id[:8])
-            stato = "attivo" if iscritto.get("attivo") else "disattivo"
-            label = f"{iscritto.get('cognome', '-')} {iscritto.get('nome', '-')} | {sede_nome} | {stato}"
-            item = QListWidgetItem(label)
-            item.setData(1, iscritto.get("id", ""))
-            self.iscritti_list_widget.addItem(item)
+        with _bulk_update(self.iscritti_list_widget):
+            self.iscritti_list_widget.clear()
+            add_item = self.iscritti_list_widget.addItem
+            for iscritto in iscritti:
+                get = iscritto.get
+                sede_id = str(get("sede_id", ""))
+                label = _ISCRITTO_LABEL.format(
+                    cognome=get("cognome", "-"),
+                    nome=get("nome", "-"),
+                    sede_nome=sedi_map.get(sede_id, sede_id[:8]),
+                    stato="attivo" if get("attivo") else "disattivo",
+                )
+                item = QListWidgetItem(label)
+                item.setData(1, get("id", ""))
+                add_item(item)
 
     def append_iscritti_status(self, message: str) -> None:
-        self.iscritti_status.append(message)
+        self.iscritti_status.appendPlainText(message)
 
     def clear_iscritto_form(self) -> None:
         self.iscritto_nome_input.clear()
@@ -622,7 +665,7 @@ class DashboardView(QWidget):
             self.sedi_list_widget.addItem(item)
 
     def append_sedi_status(self, message: str) -> None:
-        self.sedi_status.append(message)
+        self.sedi_status.appendPlainText(message)
 
     def clear_sede_form(self) -> None:
         self.sedi_nome_input.clear()
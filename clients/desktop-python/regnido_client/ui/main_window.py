@@ -1,12 +1,20 @@
+import asyncio
+import re
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-import json
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Awaitable, Callable, TypeVar
 
 import httpx
+import orjson
 from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QAction
 from PySide6.QtWidgets import QApplication, QFileDialog, QMainWindow, QMessageBox, QStackedWidget
+from qasync import asyncSlot, asyncWrap
 
 from regnido_client.config import DB_PATH, DEFAULT_API_BASE_URL
 from regnido_client.services.api_client import ApiClient
@@ -19,6 +27,49 @@ from regnido_client.ui.settings_dialog import SettingsDialog
 from regnido_client.version import APP_VERSION
 
 VIRTUAL_DEVICE_ID = "00000000-0000-0000-0000-000000000000"
+T = TypeVar("T")
+SYNC_CHUNK_SIZE = 25
+SYNC_BATCH_LIMIT = 200
+SYNC_BACKOFF_MIN_MS = 1000
+SYNC_BACKOFF_MAX_MS = 300_000
+HEALTH_INTERVAL_SECONDS = 5.0
+HEALTH_INTERVAL_MAX_SECONDS = 60.0
+EVENT_ID_POOL_SIZE = 32
+ISCRITTO_SEDE_REQUIRED = "Sede obbligatoria per creare un iscritto"
+ISCRITTO_NAME_REQUIRED = "Nome e cognome obbligatori"
+# Ogni sequenza di caratteri non ammessi (trattino compreso) diventa un solo trattino.
+_FILENAME_UNSAFE = re.compile(r"[^A-Za-z0-9_]+")
+
+
+@lru_cache(maxsize=16)
+def _history_pdf_filename(periodo: str, sede_label: str, iscritto_label: str) -> str:
+    def sanitize(raw: str) -> str:
+        return _FILENAME_UNSAFE.sub("-", raw).strip("-") or "ND"
+
+    return f"{sanitize(iscritto_label)}-{sanitize(periodo)}-{sanitize(sede_label)}.pdf"
+
+
+def _pretty_json(data: object) -> str:
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _chunk_events_by_bambino(events: list[dict[str, str]], size: int) -> list[list[dict[str, str]]]:
+    # Gli eventi dello stesso bambino restano nello stesso blocco e nell'ordine originale:
+    # il server valida ENTRATA/USCITA rispetto all'ultimo evento registrato.
+    groups: dict[str, list[dict[str, str]]] = {}
+    for event in events:
+        groups.setdefault(event["bambino_id"], []).append(event)
+
+    chunks: list[list[dict[str, str]]] = []
+    current: list[dict[str, str]] = []
+    for group in groups.values():
+        if current and len(current) + len(group) > size:
+            chunks.append(current)
+            current = []
+        current.extend(group)
+    if current:
+        chunks.append(current)
+    return chunks
 
 
 class MainWindow(QMainWindow):
@@ -28,56 +79,62 @@ class MainWindow(QMainWindow):
         self.resize(1100, 700)
 
         self.store = LocalStore(DB_PATH)
-        self.api = ApiClient(self.store.get_setting("api_base_url", DEFAULT_API_BASE_URL))
+        self._api_base_url, self._access_token, self._key_file_path = self._settings_stored()
+        # Dopo l'avvio sqlite gira su un solo thread dedicato: accesso serializzato, GUI mai bloccata.
+        self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="regnido-sqlite")
+        self.api = ApiClient(self._api_base_url)
         self.admin_token = ""
 
-        self.setup_view = SetupView()
-        self.login_view = LoginView()
-        self.dashboard = DashboardView()
+        # Setup, login e dashboard vengono costruite solo quando servono (vedi le property omonime):
+        # all'avvio viene istanziata soltanto la schermata effettivamente mostrata.
+        self._setup_view: SetupView | None = None
+        self._login_view: LoginView | None = None
+        self._dashboard: DashboardView | None = None
 
         self.stack = QStackedWidget()
-        self.stack.addWidget(self.setup_view)
-        self.stack.addWidget(self.login_view)
-        self.stack.addWidget(self.dashboard)
         self.setCentralWidget(self.stack)
         self._build_top_menu()
 
-        self.setup_view.save_requested.connect(self._on_setup_save_requested)
-        self.setup_view.test_requested.connect(self._on_setup_test_requested)
-        self.setup_view.admin_login_requested.connect(self._on_admin_login_requested)
-        self.setup_view.admin_refresh_sedi_requested.connect(self._on_admin_refresh_sedi_requested)
-        self.setup_view.admin_create_sede_requested.connect(self._on_admin_create_sede_requested)
-        self.setup_view.admin_create_bambino_requested.connect(self._on_admin_create_bambino_requested)
-        self.login_view.login_requested.connect(self._on_login_requested)
-        self.login_view.setup_requested.connect(self._show_setup)
-        self.dashboard.check_in_requested.connect(lambda b: self._submit_presence_event(b, "ENTRATA", "/presenze/check-in"))
-        self.dashboard.check_out_requested.connect(lambda b: self._submit_presence_event(b, "USCITA", "/presenze/check-out"))
-        self.dashboard.sync_requested.connect(self._sync_pending)
-        self.dashboard.settings_requested.connect(self._open_settings)
-        self.dashboard.refresh_device_requested.connect(self._refresh_device)
-        self.dashboard.logout_requested.connect(self._on_logout_requested)
-        self.dashboard.refresh_users_requested.connect(self._on_refresh_users_requested)
-        self.dashboard.create_user_requested.connect(self._on_create_user_requested)
-        self.dashboard.refresh_iscritti_requested.connect(self._on_refresh_iscritti_requested)
-        self.dashboard.create_iscritto_requested.connect(self._on_create_iscritto_requested)
-        self.dashboard.delete_iscritto_requested.connect(self._on_delete_iscritto_requested)
-        self.dashboard.refresh_sedi_requested.connect(self._on_refresh_sedi_requested)
-        self.dashboard.create_sede_requested.connect(self._on_create_sede_requested)
-        self.dashboard.disable_sede_requested.connect(self._on_disable_sede_requested)
-        self.dashboard.refresh_history_requested.connect(self._on_refresh_history_requested)
-        self.dashboard.export_history_requested.connect(self._on_export_history_requested)
-        self.dashboard.history_sede_changed.connect(self._on_history_sede_changed)
-
-        self.sync_timer = QTimer(self)
-        self.sync_timer.setInterval(30000)
-        self.sync_timer.timeout.connect(self._sync_pending)
-        self.health_timer = QTimer(self)
-        self.health_timer.setInterval(5000)
-        self.health_timer.timeout.connect(self._probe_connection_health)
+
+        # Health check e sync girano in un unico task in background: un tick alla volta, niente
+        # richieste accavallate. La sync parte quando ci sono eventi in coda o torna la rete,
+        # con backoff esponenziale sugli errori.
+        self._background_task: asyncio.Task | None = None
+        self._background_wakeup = asyncio.Event()
+        self._sync_due: float | None = None
+        self._sync_backoff_ms = SYNC_BACKOFF_MIN_MS
+        self._health_interval = HEALTH_INTERVAL_SECONDS
+        self._backend_online = False
         self.resume_timer = QTimer(self)
         self.resume_timer.setSingleShot(True)
         self.resume_timer.setInterval(1200)
         self.resume_timer.timeout.connect(self._recover_after_resume)
+        # Richieste ravvicinate dell'elenco presenze vengono accorpate in una sola chiamata.
+        self._search_debounce = QTimer(self)
+        self._search_debounce.setSingleShot(True)
+        self._search_debounce.setInterval(250)
+        self._search_debounce.timeout.connect(self._run_search)
+        self._pending_query = ""
+        self._search_task: asyncio.Task | None = None
+        self._search_seq = 0
+        # Scorrendo le sedi dello storico con le frecce parte solo il fetch dell'ultima selezione.
+        self._history_sede_debounce = QTimer(self)
+        self._history_sede_debounce.setSingleShot(True)
+        self._history_sede_debounce.setInterval(250)
+        self._history_sede_debounce.timeout.connect(self._do_history_sede_fetch)
+        self._pending_sede_id = ""
+        self._history_sede_task: asyncio.Task | None = None
+        self._sedi_map_cache: tuple[list[dict[str, Any]], dict[str, str]] | None = None
+        # Refresh admin dopo create/elimina: piu' azioni ravvicinate producono un solo giro di GET.
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(150)
+        self._refresh_timer.timeout.connect(self._flush_refresh)
+        self._need_iscritti = False
+        self._need_sedi = False
+        # Id evento pre-generati a loop inattivo: il click su Entra/Esce li preleva senza crearli.
+        self._event_id_pool: deque[str] = deque(maxlen=EVENT_ID_POOL_SIZE)
+        QTimer.singleShot(0, self._refill_event_id_pool)
         self._was_suspended = False
         self._sync_in_progress = False
         self._health_in_progress = False
@@ -86,64 +143,116 @@ class MainWindow(QMainWindow):
         if app is not None:
             app.applicationStateChanged.connect(self._on_application_state_changed)
 
-        self.setup_view.set_values(
-            self.store.get_setting("api_base_url", DEFAULT_API_BASE_URL),
-        )
-        self.login_view.key_file_input.setText(self.store.get_setting("key_file_path", ""))
         self._set_navigation_actions(False, False)
 
-        api_base_url = self.store.get_setting("api_base_url", DEFAULT_API_BASE_URL)
-        saved_token = self.store.get_setting("access_token", "")
-        if not api_base_url:
+        if not self._api_base_url:
             self.stack.setCurrentWidget(self.setup_view)
             self.setup_view.set_status("Inserisci URL backend per iniziare")
             self._set_navigation_actions(False, False)
-        elif saved_token:
-            self.api.set_token(saved_token)
-            if not self.api.token_still_valid():
-                self.store.set_setting("access_token", "")
-                self.api.set_token("")
-                self.stack.setCurrentWidget(self.login_view)
-                self.login_view.set_status("Sessione scaduta. Esegui di nuovo il login.", is_error=True)
-                self._update_login_health()
-                self._set_navigation_actions(False, False)
-            else:
-                self.stack.setCurrentWidget(self.dashboard)
-                self.sync_timer.start()
-                self.health_timer.start()
-                self._set_navigation_actions(True, False)
-                self._post_login_refresh()
+        elif self._access_token:
+            # La sessione salvata viene verificata sul loop asyncio, senza bloccare l'apertura della finestra.
+            self.api.set_token(self._access_token)
+            self.stack.setCurrentWidget(self.dashboard)
+            self.dashboard.set_connection_status("verifica sessione...", ok=False)
+            self._restore_session()
         else:
             self.stack.setCurrentWidget(self.login_view)
+            self.login_view.set_status("Verifica backend...")
             self._update_login_health()
             self._set_navigation_actions(False, False)
 
+    @asyncSlot()
+    async def _restore_session(self) -> None:
+        if not await self.api.token_still_valid():
+            self._save_access_token("")
+            self.api.set_token("")
+            self.stack.setCurrentWidget(self.login_view)
+            self.login_view.set_status("Sessione scaduta. Esegui di nuovo il login.", is_error=True)
+            await self._update_login_health()
+            self._set_navigation_actions(False, False)
+            return
+        self._start_background_loop()
+        self._set_navigation_actions(True, False)
+        await self._post_login_refresh()
+
+    @property
+    def setup_view(self) -> SetupView:
+        if self._setup_view is None:
+            self._setup_view = SetupView()
+            self._setup_view.set_values(self._api_base_url)
+            self._setup_view.save_requested.connect(self._on_setup_save_requested)
+            self._setup_view.test_requested.connect(self._on_setup_test_requested)
+            self._setup_view.admin_login_requested.connect(self._on_admin_login_requested)
+            self._setup_view.admin_refresh_sedi_requested.connect(self._on_admin_refresh_sedi_requested)
+            self._setup_view.admin_create_sede_requested.connect(self._on_admin_create_sede_requested)
+            self._setup_view.admin_create_bambino_requested.connect(self._on_admin_create_bambino_requested)
+            self.stack.addWidget(self._setup_view)
+        return self._setup_view
+
+    @property
+    def login_view(self) -> LoginView:
+        if self._login_view is None:
+            self._login_view = LoginView()
+            self._login_view.key_file_input.setText(self._key_file_path)
+            self._login_view.login_requested.connect(self._on_login_requested)
+            self._login_view.setup_requested.connect(self._show_setup)
+            self.stack.addWidget(self._login_view)
+        return self._login_view
+
+    @property
+    def dashboard(self) -> DashboardView:
+        if self._dashboard is None:
+            self._dashboard = DashboardView()
+            self._wire_dashboard_signals(self._dashboard)
+            self.stack.addWidget(self._dashboard)
+        return self._dashboard
+
+    def _wire_dashboard_signals(self, dashboard: DashboardView) -> None:
+        dashboard.check_in_requested.connect(self._on_check_in_requested)
+        dashboard.check_out_requested.connect(self._on_check_out_requested)
+        dashboard.sync_requested.connect(self._sync_pending)
+        dashboard.settings_requested.connect(self._open_settings)
+        dashboard.refresh_device_requested.connect(self._refresh_device)
+        dashboard.logout_requested.connect(self._on_logout_requested)
+        dashboard.refresh_users_requested.connect(self._on_refresh_users_requested)
+        dashboard.create_user_requested.connect(self._on_create_user_requested)
+        dashboard.refresh_iscritti_requested.connect(self._on_refresh_iscritti_requested)
+        dashboard.create_iscritto_requested.connect(self._on_create_iscritto_requested)
+        dashboard.delete_iscritto_requested.connect(self._on_delete_iscritto_requested)
+        dashboard.refresh_sedi_requested.connect(self._on_refresh_sedi_requested)
+        dashboard.create_sede_requested.connect(self._on_create_sede_requested)
+        dashboard.disable_sede_requested.connect(self._on_disable_sede_requested)
+        dashboard.refresh_history_requested.connect(self._on_refresh_history_requested)
+        dashboard.export_history_requested.connect(self._on_export_history_requested)
+        dashboard.history_sede_changed.connect(self._on_history_sede_changed)
+
     def _on_application_state_changed(self, state: Qt.ApplicationState) -> None:
         if state == Qt.ApplicationActive:
             if not self._was_suspended:
                 return
             self._was_suspended = False
-            self.dashboard.set_connection_status("ripristino dopo standby...", ok=False)
+            if self._dashboard is not None:
+                self._dashboard.set_connection_status("ripristino dopo standby...", ok=False)
             self.resume_timer.start()
             return
 
-        # Durante standby/background fermiamo i timer per evitare chiamate rete pendenti.
+        # Durante standby/background fermiamo il ciclo health/sync per evitare chiamate rete pendenti.
         self._was_suspended = True
-        self.sync_timer.stop()
-        self.health_timer.stop()
+        self._stop_background_loop()
 
-    def _recover_after_resume(self) -> None:
-        is_logged_in = bool(self.store.get_setting("access_token", ""))
+    @asyncSlot()
+    async def _recover_after_resume(self) -> None:
+        is_logged_in = bool(self._access_token)
         if not is_logged_in:
             return
-        if self.stack.currentWidget() is self.dashboard:
-            self.sync_timer.start()
-            self.health_timer.start()
-            self._probe_connection_health()
-            self._sync_pending()
-            self._on_search_requested("")
-        elif self.stack.currentWidget() is self.login_view:
-            self._update_login_health()
+        current = self.stack.currentWidget()
+        if self._dashboard is not None and current is self._dashboard:
+            self._start_background_loop()
+            await self._probe_connection_health()
+            await self._sync_pending()
+            self._request_search("")
+        elif self._login_view is not None and current is self._login_view:
+            await self._update_login_health()
 
     def _build_top_menu(self) -> None:
         sections_menu = self.menuBar().addMenu("Sezioni")
@@ -173,9 +282,10 @@ class MainWindow(QMainWindow):
         self.action_go_iscritti.setEnabled(logged_in and is_admin)
         self.action_go_sedi.setEnabled(logged_in and is_admin)
 
-    def _update_login_health(self) -> None:
+    @asyncSlot()
+    async def _update_login_health(self) -> None:
         try:
-            details = self.api.health_details()
+            details = await self.api.health_head()
         except httpx.HTTPError:
             self.login_view.set_status("Backend non raggiungibile", is_error=True)
             return
@@ -189,16 +299,17 @@ class MainWindow(QMainWindow):
             return
         self.login_view.set_status("Backend raggiungibile")
 
-    def _on_login_requested(self, username: str, key_file_path: str, passphrase: str) -> None:
+    @asyncSlot(str, str, str)
+    async def _on_login_requested(self, username: str, key_file_path: str, passphrase: str) -> None:
         if not username or not key_file_path or not passphrase:
             self.login_view.set_status("Inserisci username, file chiave e passphrase", is_error=True)
             return
 
         try:
             key_payload = read_key_file(key_file_path)
-            challenge = self.api.auth_challenge(username)
+            challenge = await self.api.auth_challenge(username)
             key_id, signature_b64 = sign_challenge(key_payload, passphrase, str(challenge["challenge"]))
-            token = self.api.auth_challenge_complete(
+            token = await self.api.auth_challenge_complete(
                 challenge_id=str(challenge["challenge_id"]),
                 key_id=key_id,
                 signature_b64=signature_b64,
@@ -214,25 +325,26 @@ class MainWindow(QMainWindow):
             self.login_view.set_status(f"Errore di rete: {exc}", is_error=True)
             return
 
-        self.store.set_setting("access_token", token)
-        self.store.set_setting("username", username)
-        self.store.set_setting("key_file_path", key_file_path)
+        self._save_access_token(token)
+        self._key_file_path = key_file_path
+        self._store_later(self.store.set_setting, "username", username)
+        self._store_later(self.store.set_setting, "key_file_path", key_file_path)
         self.login_view.set_status("Login eseguito")
         self.stack.setCurrentWidget(self.dashboard)
-        self.sync_timer.start()
-        self.health_timer.start()
+        self._start_background_loop()
         self._set_navigation_actions(True, False)
         self.dashboard.go_to_section("presenze")
-        self._post_login_refresh()
+        await self._post_login_refresh()
 
     def _show_setup(self) -> None:
         self.setup_view.set_values(
-            self.store.get_setting("api_base_url", DEFAULT_API_BASE_URL),
+            self._api_base_url,
         )
         self.stack.setCurrentWidget(self.setup_view)
         self._set_navigation_actions(False, False)
 
-    def _on_setup_test_requested(self, api_base_url: str) -> None:
+    @asyncSlot(str)
+    async def _on_setup_test_requested(self, api_base_url: str) -> None:
         if not api_base_url:
             self.setup_view.set_status("Inserisci API Base URL", is_error=True)
             return
@@ -242,7 +354,7 @@ class MainWindow(QMainWindow):
         ok = False
         skew = 0
         try:
-            details = self.api.health_details()
+            details = await self.api.health_head()
             ok = details.get("status") == "ok"
             skew = abs(int(details.get("clock_skew_seconds", 0)))
         except httpx.HTTPError:
@@ -256,7 +368,8 @@ class MainWindow(QMainWindow):
             return
         self.setup_view.set_status("Backend non raggiungibile", is_error=True)
 
-    def _on_admin_login_requested(self, api_base_url: str, username: str, key_file_path: str, passphrase: str) -> None:
+    @asyncSlot(str, str, str, str)
+    async def _on_admin_login_requested(self, api_base_url: str, username: str, key_file_path: str, passphrase: str) -> None:
         if not api_base_url or not username or not key_file_path or not passphrase:
             self.setup_view.set_admin_status("Inserisci URL, username, file chiave e passphrase", is_error=True)
             return
@@ -264,13 +377,12 @@ class MainWindow(QMainWindow):
             self.setup_view.set_admin_status("API Base URL non valido", is_error=True)
             return
 
-        self.store.set_setting("api_base_url", api_base_url)
-        self.api.set_base_url(api_base_url)
+        self._save_api_base_url(api_base_url)
         try:
             key_payload = read_key_file(key_file_path)
-            challenge = self.api.auth_challenge(username)
+            challenge = await self.api.auth_challenge(username)
             key_id, signature_b64 = sign_challenge(key_payload, passphrase, str(challenge["challenge"]))
-            self.admin_token = self.api.auth_challenge_complete(
+            self.admin_token = await self.api.auth_challenge_complete(
                 challenge_id=str(challenge["challenge_id"]),
                 key_id=key_id,
                 signature_b64=signature_b64,
@@ -278,7 +390,7 @@ class MainWindow(QMainWindow):
             self.setup_view.set_admin_enabled(True)
             self.setup_view.set_admin_status(f"Admin autenticato: {username}")
             self.setup_view.append_admin_output("Login admin OK")
-            self._on_admin_refresh_sedi_requested()
+            await self._on_admin_refresh_sedi_requested()
         except ValueError as exc:
             self.setup_view.set_admin_enabled(False)
             self.setup_view.set_admin_status("File chiave non valido", is_error=True)
@@ -292,12 +404,13 @@ class MainWindow(QMainWindow):
             self.setup_view.set_admin_status("Errore rete admin", is_error=True)
             self.setup_view.append_admin_output(f"Errore rete: {exc}")
 
-    def _on_admin_refresh_sedi_requested(self) -> None:
+    @asyncSlot()
+    async def _on_admin_refresh_sedi_requested(self) -> None:
         if not self.admin_token:
             self.setup_view.set_admin_status("Esegui login admin prima", is_error=True)
             return
         try:
-            rows = self.api.list_sedi(admin_token=self.admin_token)
+            rows = await self.api.list_sedi(admin_token=self.admin_token)
             sedi = [(row["id"], row["nome"]) for row in rows]
             self.setup_view.set_sedi(sedi)
             self.setup_view.append_admin_output(f"Sedi caricate: {len(sedi)}")
@@ -306,7 +419,8 @@ class MainWindow(QMainWindow):
         except httpx.HTTPError as exc:
             self.setup_view.append_admin_output(f"Errore rete: {exc}")
 
-    def _on_admin_create_sede_requested(self, nome: str) -> None:
+    @asyncSlot(str)
+    async def _on_admin_create_sede_requested(self, nome: str) -> None:
         if not self.admin_token:
             self.setup_view.set_admin_status("Esegui login admin prima", is_error=True)
             return
@@ -314,18 +428,19 @@ class MainWindow(QMainWindow):
             self.setup_view.set_admin_status("Nome sede obbligatorio", is_error=True)
             return
         try:
-            data = self.api.create_sede(nome=nome, admin_token=self.admin_token)
+            data = await self.api.create_sede(nome=nome, admin_token=self.admin_token)
             sede_id = data["id"]
-            self.setup_view.last_sede_id_label.setText(sede_id)
-            self._on_admin_refresh_sedi_requested()
+            self.setup_view.set_last_sede_id(sede_id)
+            await self._on_admin_refresh_sedi_requested()
             self.setup_view.select_sede(sede_id)
-            self.setup_view.append_admin_output(json.dumps(data, indent=2, ensure_ascii=False))
+            self.setup_view.append_admin_output(_pretty_json(data))
         except httpx.HTTPStatusError as exc:
             self.setup_view.append_admin_output(f"Errore crea sede: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.setup_view.append_admin_output(f"Errore rete: {exc}")
 
-    def _on_admin_create_bambino_requested(self, sede_id: str, nome: str, cognome: str, attivo: bool) -> None:
+    @asyncSlot(str, str, str, bool)
+    async def _on_admin_create_bambino_requested(self, sede_id: str, nome: str, cognome: str, attivo: bool) -> None:
         if not self.admin_token:
             self.setup_view.set_admin_status("Esegui login admin prima", is_error=True)
             return
@@ -333,20 +448,21 @@ class MainWindow(QMainWindow):
             self.setup_view.set_admin_status("Sede ID, nome e cognome obbligatori", is_error=True)
             return
         try:
-            data = self.api.create_bambino(
+            data = await self.api.create_bambino(
                 sede_id=sede_id,
                 nome=nome,
                 cognome=cognome,
                 attivo=attivo,
                 admin_token=self.admin_token,
             )
-            self.setup_view.append_admin_output(json.dumps(data, indent=2, ensure_ascii=False))
+            self.setup_view.append_admin_output(_pretty_json(data))
         except httpx.HTTPStatusError as exc:
             self.setup_view.append_admin_output(f"Errore crea bambino: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.setup_view.append_admin_output(f"Errore rete: {exc}")
 
-    def _on_setup_save_requested(self, api_base_url: str) -> None:
+    @asyncSlot(str)
+    async def _on_setup_save_requested(self, api_base_url: str) -> None:
         if not api_base_url:
             self.setup_view.set_status("API Base URL obbligatorio", is_error=True)
             return
@@ -354,26 +470,62 @@ class MainWindow(QMainWindow):
             self.setup_view.set_status("API Base URL deve iniziare con http:// o https://", is_error=True)
             return
 
-        self.store.set_setting("api_base_url", api_base_url)
-        self.api.set_base_url(api_base_url)
+        self._save_api_base_url(api_base_url)
 
         self.setup_view.set_status("Configurazione salvata")
         self.stack.setCurrentWidget(self.login_view)
-        self._update_login_health()
+        await self._update_login_health()
 
-    def _post_login_refresh(self) -> None:
-        self._probe_connection_health()
-        self._refresh_user_capabilities()
-        self._refresh_device()
-        self._on_search_requested("")
-        self._sync_pending()
+    async def _store(self, fn: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._store_executor, fn, *args)
+
+    def _store_later(self, fn: Callable[..., Any], *args: Any) -> None:
+        self._store_executor.submit(fn, *args)
+
+    async def aclose(self) -> None:
+        self._stop_background_loop()
+        await self.api.aclose()
+        self._store_executor.shutdown(wait=True)
+
+    def _settings_stored(self) -> tuple[str, str, str]:
+        values = self.store.get_settings(
+            {"api_base_url": DEFAULT_API_BASE_URL, "access_token": "", "key_file_path": ""}
+        )
+        return values["api_base_url"], values["access_token"], values["key_file_path"]
+
+    def _save_api_base_url(self, api_base_url: str) -> None:
+        self._store_later(self.store.set_setting, "api_base_url", api_base_url)
+        self._api_base_url = api_base_url
+        self.api.set_base_url(api_base_url)
+
+    def _save_access_token(self, token: str) -> None:
+        self._store_later(self.store.set_setting, "access_token", token)
+        self._access_token = token
+
+    async def _post_login_refresh(self) -> None:
+        # Dopo il login la lista parte subito, senza debounce, insieme alle altre chiamate iniziali.
+        self._pending_query = ""
+        self._run_search()
+        # Il profilo serve sia alle capability sia all'etichetta dispositivo: una sola richiesta condivisa.
+        profile = asyncio.ensure_future(self.api.auth_me())
+        results = await asyncio.gather(
+            self._search_task,
+            self._probe_connection_health(),
+            self._refresh_user_capabilities(profile),
+            self._show_device_profile(profile),
+            self._sync_pending(),
+            return_exceptions=True,
+        )
+        # Un errore inatteso non interrompe le altre chiamate, ma non va perso.
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
 
     def _on_logout_requested(self) -> None:
-        self.sync_timer.stop()
-        self.health_timer.stop()
+        self._stop_background_loop()
         self.resume_timer.stop()
         self._was_suspended = False
-        self.store.set_setting("access_token", "")
+        self._save_access_token("")
         self.api.set_token("")
         self.dashboard.set_admin_tabs_visible(False)
         self.stack.setCurrentWidget(self.login_view)
@@ -381,13 +533,15 @@ class MainWindow(QMainWindow):
         self._set_navigation_actions(False, False)
         self._update_login_health()
 
-    def _probe_connection_health(self) -> None:
+    @asyncSlot()
+    async def _probe_connection_health(self) -> None:
         if self._health_in_progress:
             return
         self._health_in_progress = True
-        probe = self.api.ping()
         try:
-            now_local = datetime.now().strftime("%H:%M:%S")
+            probe = await self.api.ping()
+            t = datetime.now()
+            now_local = f"{t.hour:02d}:{t.minute:02d}:{t.second:02d}"
             latency_ms = int(probe.get("latency_ms", 0))
             if bool(probe.get("ok")):
                 skew = abs(int(probe.get("clock_skew_seconds", 0)))
@@ -395,7 +549,14 @@ class MainWindow(QMainWindow):
                 if skew > 300:
                     msg += f" | clock skew ~{skew}s"
                 self.dashboard.set_connection_status(msg, ok=True)
+                if not self._backend_online and self.store.count_pending():
+                    self._schedule_sync()
+                self._backend_online = True
+                self._health_interval = HEALTH_INTERVAL_SECONDS
                 return
+            self._backend_online = False
+            # Backend giu': controlli sempre piu' radi (5 -> 10 -> 20 -> ... 60 s) finche' non torna.
+            self._health_interval = min(self._health_interval * 2, HEALTH_INTERVAL_MAX_SECONDS)
             error = str(probe.get("error", "backend non raggiungibile")).strip()
             compact_error = error if len(error) <= 80 else f"{error[:77]}..."
             self.dashboard.set_connection_status(
@@ -405,9 +566,9 @@ class MainWindow(QMainWindow):
         finally:
             self._health_in_progress = False
 
-    def _refresh_user_capabilities(self) -> None:
+    async def _refresh_user_capabilities(self, profile_request: Awaitable[dict[str, Any]] | None = None) -> None:
         try:
-            profile = self.api.auth_me()
+            profile = await (profile_request if profile_request is not None else self.api.auth_me())
         except httpx.HTTPError:
             self.dashboard.set_admin_tabs_visible(False)
             return
@@ -416,18 +577,25 @@ class MainWindow(QMainWindow):
         is_admin = "admin" in groups
         self.dashboard.set_admin_tabs_visible(is_admin)
         self._set_navigation_actions(True, is_admin)
-        self._load_history_filters()
-        self._on_refresh_history_requested(*self.dashboard.history_filters())
+        jobs = [self._load_history()]
         if is_admin:
-            self._on_refresh_users_requested()
-            self._load_sedi_for_users()
-            self._load_sedi_for_iscritti()
-            self._on_refresh_sedi_requested()
-            self._on_refresh_iscritti_requested("", False)
+            # Una sola lettura delle sedi, condivisa da tutte le viste admin caricate in parallelo.
+            sedi = asyncio.ensure_future(self.api.list_sedi_auth())
+            jobs += [
+                self._on_refresh_users_requested(),
+                self._refresh_sedi_views(sedi),
+                self._load_iscritti("", False, sedi),
+            ]
+        await asyncio.gather(*jobs)
+
+    async def _load_history(self) -> None:
+        await self._load_history_filters()
+        await self._on_refresh_history_requested(*self.dashboard.history_filters())
 
-    def _on_refresh_users_requested(self) -> None:
+    @asyncSlot()
+    async def _on_refresh_users_requested(self) -> None:
         try:
-            rows = self.api.list_users()
+            rows = await self.api.list_users()
             self.dashboard.set_users(rows)
             self.dashboard.append_users_status(f"Utenti caricati: {len(rows)}")
         except httpx.HTTPStatusError as exc:
@@ -435,7 +603,8 @@ class MainWindow(QMainWindow):
         except httpx.HTTPError as exc:
             self.dashboard.append_users_status(f"Errore rete elenco utenti: {exc}")
 
-    def _on_create_user_requested(
+    @asyncSlot(str, str, bool, str, str, str, int)
+    async def _on_create_user_requested(
         self,
         username: str,
         role: str,
@@ -450,7 +619,7 @@ class MainWindow(QMainWindow):
             return
 
         try:
-            created = self.api.create_user(
+            created = await self.api.create_user(
                 username=username,
                 role=role,
                 attivo=attivo,
@@ -460,7 +629,8 @@ class MainWindow(QMainWindow):
                 key_valid_days=key_valid_days,
             )
             default_name = str(created.get("key_file_name") or f"{username}.rnk")
-            selected, _ = QFileDialog.getSaveFileName(
+            selected, _ = await asyncWrap(
+                QFileDialog.getSaveFileName,
                 self,
                 "Salva file chiave utente",
                 str(Path.home() / default_name),
@@ -468,113 +638,134 @@ class MainWindow(QMainWindow):
             )
             if selected:
                 Path(selected).write_text(str(created.get("key_file_payload", "")), encoding="utf-8")
-                self.dashboard.append_users_status(f"File chiave salvato: {selected}")
+                key_message = f"File chiave salvato: {selected}"
             else:
-                self.dashboard.append_users_status("Utente creato, ma file chiave non salvato")
+                key_message = "Utente creato, ma file chiave non salvato"
             self.dashboard.append_users_status(
-                f"Utente creato: {created.get('username')} ({created.get('role')})"
+                f"{key_message}\nUtente creato: {created.get('username')} ({created.get('role')})"
             )
             self.dashboard.clear_user_form()
-            self._on_refresh_users_requested()
+            await self._on_refresh_users_requested()
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_users_status(f"Errore creazione utente: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_users_status(f"Errore rete creazione utente: {exc}")
 
-    def _load_sedi_for_users(self) -> None:
+    @asyncSlot()
+    async def _on_refresh_sedi_requested(self) -> None:
+        await self._refresh_sedi_views()
+
+    def _request_refresh(self, iscritti: bool = False, sedi: bool = False) -> None:
+        self._need_iscritti |= iscritti
+        self._need_sedi |= sedi
+        self._refresh_timer.start()
+
+    @asyncSlot()
+    async def _flush_refresh(self) -> None:
+        need_iscritti, need_sedi = self._need_iscritti, self._need_sedi
+        self._need_iscritti = self._need_sedi = False
+        sedi = asyncio.ensure_future(self.api.list_sedi_auth())
+        jobs = []
+        if need_sedi:
+            jobs.append(self._refresh_sedi_views(sedi))
+        if need_iscritti:
+            jobs.append(self._load_iscritti("", False, sedi))
+        await asyncio.gather(*jobs)
+
+    async def _refresh_sedi_views(self, sedi: Awaitable[list[dict[str, Any]]] | None = None) -> None:
+        # Elenco sedi admin e combo di utenti/iscritti usano la stessa risposta.
         try:
-            rows = self.api.list_sedi_auth()
-            sedi = [(row["id"], row["nome"]) for row in rows if bool(row.get("attiva", True))]
-            self.dashboard.set_sedi_for_users(sedi)
-        except httpx.HTTPStatusError as exc:
-            self.dashboard.append_users_status(f"Errore sedi utenti: {exc.response.text}")
-        except httpx.HTTPError as exc:
-            self.dashboard.append_users_status(f"Errore rete sedi utenti: {exc}")
-
-    def _load_sedi_for_iscritti(self) -> None:
-        try:
-            rows = self.api.list_sedi_auth()
-            sedi = [(row["id"], row["nome"]) for row in rows if bool(row.get("attiva", True))]
-            self.dashboard.set_sedi_for_iscritti(sedi)
-        except httpx.HTTPStatusError as exc:
-            self.dashboard.append_iscritti_status(f"Errore sedi iscritti: {exc.response.text}")
-        except httpx.HTTPError as exc:
-            self.dashboard.append_iscritti_status(f"Errore rete sedi iscritti: {exc}")
-
-    def _on_refresh_sedi_requested(self) -> None:
-        try:
-            rows = self.api.list_sedi_auth()
-            self.dashboard.set_sedi_admin(rows)
-            self.dashboard.append_sedi_status(f"Sedi caricate: {len(rows)}")
+            rows = await (sedi if sedi is not None else self.api.list_sedi_auth())
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_sedi_status(f"Errore elenco sedi: {exc.response.text}")
+            return
         except httpx.HTTPError as exc:
             self.dashboard.append_sedi_status(f"Errore rete elenco sedi: {exc}")
-
-    def _on_create_sede_requested(self, nome: str) -> None:
+            return
+        self.dashboard.set_sedi_admin(rows)
+        self.dashboard.append_sedi_status(f"Sedi caricate: {len(rows)}")
+        attive = [(row["id"], row["nome"]) for row in rows if bool(row.get("attiva", True))]
+        self.dashboard.set_sedi_for_users(attive)
+        self.dashboard.set_sedi_for_iscritti(attive)
+
+    @asyncSlot(str)
+    async def _on_create_sede_requested(self, nome: str) -> None:
         nome_norm = nome.strip()
         if not nome_norm:
             self.dashboard.append_sedi_status("Nome sede obbligatorio")
             return
         try:
-            created = self.api.create_sede(nome=nome_norm, admin_token=self.api.token)
+            created = await self.api.create_sede(nome=nome_norm, admin_token=self.api.token)
             self.dashboard.append_sedi_status(f"Sede creata: {created.get('nome')}")
             self.dashboard.clear_sede_form()
-            self._on_refresh_sedi_requested()
-            self._load_sedi_for_users()
-            self._load_sedi_for_iscritti()
+            self._request_refresh(sedi=True)
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_sedi_status(f"Errore creazione sede: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_sedi_status(f"Errore rete creazione sede: {exc}")
 
-    def _on_disable_sede_requested(self, sede_id: str) -> None:
+    @asyncSlot(str)
+    async def _on_disable_sede_requested(self, sede_id: str) -> None:
         if not sede_id:
             self.dashboard.append_sedi_status("Seleziona una sede da disattivare")
             return
         try:
-            disabled = self.api.disable_sede_auth(sede_id)
+            disabled = await self.api.disable_sede_auth(sede_id)
             self.dashboard.append_sedi_status(f"Sede disattivata: {disabled.get('nome')}")
-            self._on_refresh_sedi_requested()
-            self._load_sedi_for_users()
-            self._load_sedi_for_iscritti()
+            self._request_refresh(sedi=True)
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_sedi_status(f"Errore disattivazione sede: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_sedi_status(f"Errore rete disattivazione sede: {exc}")
 
-    def _load_history_filters(self) -> None:
-        try:
-            sedi_rows = self.api.list_accessible_sedi()
-            sedi = [(str(row["id"]), str(row["nome"])) for row in sedi_rows]
-            self.dashboard.set_history_sedi(sedi)
-        except httpx.HTTPStatusError as exc:
-            self.dashboard.append_history_status(f"Errore caricamento sedi storico: {exc.response.text}")
+    async def _load_history_filters(self) -> None:
+        sedi_result, iscritti_result = await asyncio.gather(
+            self.api.list_accessible_sedi(),
+            self.api.list_accessible_iscritti(),
+            return_exceptions=True,
+        )
+        if isinstance(sedi_result, httpx.HTTPStatusError):
+            self.dashboard.append_history_status(f"Errore caricamento sedi storico: {sedi_result.response.text}")
             return
-        except httpx.HTTPError as exc:
-            self.dashboard.append_history_status(f"Errore rete sedi storico: {exc}")
+        if isinstance(sedi_result, httpx.HTTPError):
+            self.dashboard.append_history_status(f"Errore rete sedi storico: {sedi_result}")
             return
-
-        try:
-            iscritti_rows = self.api.list_accessible_iscritti()
-            self.dashboard.set_history_iscritti(iscritti_rows)
-        except httpx.HTTPStatusError as exc:
-            self.dashboard.append_history_status(f"Errore caricamento iscritti storico: {exc.response.text}")
-        except httpx.HTTPError as exc:
-            self.dashboard.append_history_status(f"Errore rete iscritti storico: {exc}")
+        if isinstance(sedi_result, BaseException):
+            raise sedi_result
+        self.dashboard.set_history_sedi([(str(row["id"]), str(row["nome"])) for row in sedi_result])
+
+        if isinstance(iscritti_result, httpx.HTTPStatusError):
+            self.dashboard.append_history_status(f"Errore caricamento iscritti storico: {iscritti_result.response.text}")
+        elif isinstance(iscritti_result, httpx.HTTPError):
+            self.dashboard.append_history_status(f"Errore rete iscritti storico: {iscritti_result}")
+        elif isinstance(iscritti_result, BaseException):
+            raise iscritti_result
+        else:
+            self.dashboard.set_history_iscritti(iscritti_result)
 
     def _on_history_sede_changed(self, sede_id: str) -> None:
+        self._pending_sede_id = sede_id
+        self._history_sede_debounce.start()
+
+    def _do_history_sede_fetch(self) -> None:
+        if self._history_sede_task is not None and not self._history_sede_task.done():
+            self._history_sede_task.cancel()
+        self._history_sede_task = self._load_history_iscritti(self._pending_sede_id)
+
+    @asyncSlot(str)
+    async def _load_history_iscritti(self, sede_id: str) -> None:
         try:
-            iscritti_rows = self.api.list_accessible_iscritti(sede_id=sede_id or None)
+            iscritti_rows = await self.api.list_accessible_iscritti(sede_id=sede_id or None)
             self.dashboard.set_history_iscritti(iscritti_rows)
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_history_status(f"Errore filtro iscritti storico: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_history_status(f"Errore rete filtro iscritti storico: {exc}")
 
-    def _on_refresh_history_requested(self, unita: str, periodo: str, sede_id: str, bambino_id: str) -> None:
+    @asyncSlot(str, str, str, str)
+    async def _on_refresh_history_requested(self, unita: str, periodo: str, sede_id: str, bambino_id: str) -> None:
         try:
-            payload = self.api.list_presence_history(
+            payload = await self.api.list_presence_history(
                 unita=unita,
                 periodo=periodo,
                 sede_id=sede_id or None,
@@ -588,23 +779,11 @@ class MainWindow(QMainWindow):
         except httpx.HTTPError as exc:
             self.dashboard.append_history_status(f"Errore rete storico: {exc}")
 
-    def _on_export_history_requested(self, unita: str, periodo: str, sede_id: str, bambino_id: str) -> None:
-        try:
-            pdf_bytes = self.api.export_presence_history_pdf(
-                unita=unita,
-                periodo=periodo,
-                sede_id=sede_id or None,
-                bambino_id=bambino_id or None,
-            )
-        except httpx.HTTPStatusError as exc:
-            self.dashboard.append_history_status(f"Errore export PDF: {exc.response.text}")
-            return
-        except httpx.HTTPError as exc:
-            self.dashboard.append_history_status(f"Errore rete export PDF: {exc}")
-            return
-
+    @asyncSlot(str, str, str, str)
+    async def _on_export_history_requested(self, unita: str, periodo: str, sede_id: str, bambino_id: str) -> None:
         filename = self._build_history_pdf_filename(periodo=periodo, sede_id=sede_id, bambino_id=bambino_id)
-        selected, _ = QFileDialog.getSaveFileName(
+        selected, _ = await asyncWrap(
+            QFileDialog.getSaveFileName,
             self,
             "Salva export presenze",
             str(Path.home() / filename),
@@ -617,98 +796,119 @@ class MainWindow(QMainWindow):
         output_path = Path(selected)
         if output_path.suffix.lower() != ".pdf":
             output_path = output_path.with_suffix(".pdf")
-        output_path.write_bytes(pdf_bytes)
+        try:
+            await self.api.stream_presence_history_pdf(
+                output_path,
+                unita=unita,
+                periodo=periodo,
+                sede_id=sede_id or None,
+                bambino_id=bambino_id or None,
+            )
+        except httpx.HTTPStatusError as exc:
+            self.dashboard.append_history_status(f"Errore export PDF: {exc.response.text}")
+            return
+        except httpx.HTTPError as exc:
+            self.dashboard.append_history_status(f"Errore rete export PDF: {exc}")
+            return
+        except OSError as exc:
+            self.dashboard.append_history_status(f"Errore scrittura PDF: {exc}")
+            return
         self.dashboard.append_history_status(f"Export PDF salvato: {output_path}")
 
     def _build_history_pdf_filename(self, periodo: str, sede_id: str, bambino_id: str) -> str:
-        sede_label = "TutteSedi"
-        if sede_id:
-            idx = self.dashboard.history_sede_combo.findData(sede_id)
-            if idx >= 0:
-                sede_label = str(self.dashboard.history_sede_combo.itemText(idx).split(" (")[0])
-
-        iscritto_label = "Tutti"
-        if bambino_id:
-            idx = self.dashboard.history_iscritto_combo.findData(bambino_id)
-            if idx >= 0:
-                iscritto_label = str(self.dashboard.history_iscritto_combo.itemText(idx))
-
-        def sanitize(raw: str) -> str:
-            allowed = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
-            normalized = "".join(ch if ch in allowed else "-" for ch in raw.strip())
-            compact = "-".join(part for part in normalized.split("-") if part)
-            return compact or "ND"
-
-        return f"{sanitize(iscritto_label)}-{sanitize(periodo)}-{sanitize(sede_label)}.pdf"
-
-    def _on_refresh_iscritti_requested(self, sede_id: str, include_inactive: bool) -> None:
+        sede_label = self.dashboard.history_sede_labels.get(sede_id, "TutteSedi")
+        iscritto_label = self.dashboard.history_iscritto_labels.get(bambino_id, "Tutti")
+        return _history_pdf_filename(periodo, sede_label, iscritto_label)
+
+    @asyncSlot(str, bool)
+    async def _on_refresh_iscritti_requested(self, sede_id: str, include_inactive: bool) -> None:
+        await self._load_iscritti(sede_id, include_inactive)
+
+    async def _load_iscritti(
+        self,
+        sede_id: str,
+        include_inactive: bool,
+        sedi: Awaitable[list[dict[str, Any]]] | None = None,
+    ) -> None:
         try:
-            rows = self.api.list_bambini_admin(sede_id=sede_id or None, include_inactive=include_inactive)
-            sedi_rows = self.api.list_sedi_auth()
-            sedi_map = {str(row["id"]): str(row["nome"]) for row in sedi_rows}
-            self.dashboard.set_iscritti(rows, sedi_map)
+            rows, sedi_rows = await asyncio.gather(
+                self.api.list_bambini_admin(sede_id=sede_id or None, include_inactive=include_inactive),
+                sedi if sedi is not None else self.api.list_sedi_auth(),
+            )
+            self.dashboard.set_iscritti(rows, self._sedi_map(sedi_rows))
             self.dashboard.append_iscritti_status(f"Iscritti caricati: {len(rows)}")
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_iscritti_status(f"Errore elenco iscritti: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_iscritti_status(f"Errore rete elenco iscritti: {exc}")
 
-    def _on_create_iscritto_requested(self, sede_id: str, nome: str, cognome: str, attivo: bool) -> None:
-        if not sede_id:
-            self.dashboard.append_iscritti_status("Sede obbligatoria per creare un iscritto")
-            return
-        if not nome or not cognome:
-            self.dashboard.append_iscritti_status("Nome e cognome obbligatori")
-            return
+    def _sedi_map(self, sedi_rows: list[dict[str, Any]]) -> dict[str, str]:
+        # Finche' la cache sedi dell'ApiClient restituisce la stessa lista, la mappa id->nome non si ricostruisce.
+        if self._sedi_map_cache is None or self._sedi_map_cache[0] is not sedi_rows:
+            self._sedi_map_cache = (sedi_rows, {str(row["id"]): str(row["nome"]) for row in sedi_rows})
+        return self._sedi_map_cache[1]
+
+    @asyncSlot(str, str, str, bool)
+    async def _on_create_iscritto_requested(self, sede_id: str, nome: str, cognome: str, attivo: bool) -> None:
+        checks = ((bool(sede_id), ISCRITTO_SEDE_REQUIRED), (bool(nome and cognome), ISCRITTO_NAME_REQUIRED))
+        for ok, message in checks:
+            if not ok:
+                self.dashboard.append_iscritti_status(message)
+                return
 
         try:
-            created = self.api.create_bambino_admin(sede_id=sede_id, nome=nome, cognome=cognome, attivo=attivo)
+            created = await self.api.create_bambino_admin(sede_id=sede_id, nome=nome, cognome=cognome, attivo=attivo)
             self.dashboard.append_iscritti_status(
                 f"Iscritto creato: {created.get('cognome')} {created.get('nome')}"
             )
             self.dashboard.clear_iscritto_form()
-            self._on_refresh_iscritti_requested("", False)
+            self._request_refresh(iscritti=True)
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_iscritti_status(f"Errore creazione iscritto: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_iscritti_status(f"Errore rete creazione iscritto: {exc}")
 
-    def _on_delete_iscritto_requested(self, bambino_id: str) -> None:
+    @asyncSlot(str)
+    async def _on_delete_iscritto_requested(self, bambino_id: str) -> None:
         if not bambino_id:
             self.dashboard.append_iscritti_status("Seleziona un iscritto da eliminare")
             return
         try:
-            deleted = self.api.delete_bambino_admin(bambino_id)
+            deleted = await self.api.delete_bambino_admin(bambino_id)
             self.dashboard.append_iscritti_status(
                 f"Iscritto disattivato: {deleted.get('cognome')} {deleted.get('nome')}"
             )
-            self._on_refresh_iscritti_requested("", False)
+            self._request_refresh(iscritti=True)
         except httpx.HTTPStatusError as exc:
             self.dashboard.append_iscritti_status(f"Errore eliminazione iscritto: {exc.response.text}")
         except httpx.HTTPError as exc:
             self.dashboard.append_iscritti_status(f"Errore rete eliminazione iscritto: {exc}")
 
-    def _open_settings(self) -> None:
+    @asyncSlot()
+    async def _open_settings(self) -> None:
         dialog = SettingsDialog(
-            api_base_url=self.store.get_setting("api_base_url", DEFAULT_API_BASE_URL),
+            api_base_url=self._api_base_url,
             parent=self,
         )
-        if dialog.exec() != SettingsDialog.Accepted:
+        if await asyncWrap(dialog.exec) != SettingsDialog.Accepted:
             return
 
         api_base_url = dialog.values()
         if not api_base_url:
-            self._show_error("API Base URL obbligatorio")
+            await self._show_error("API Base URL obbligatorio")
             return
 
-        self.store.set_setting("api_base_url", api_base_url)
-        self.api.set_base_url(api_base_url)
-        self._refresh_device()
-        self._on_search_requested("")
+        self._save_api_base_url(api_base_url)
+        await self._refresh_device()
+        self._request_search("")
+
+    @asyncSlot()
+    async def _refresh_device(self) -> None:
+        await self._show_device_profile()
 
-    def _refresh_device(self) -> None:
+    async def _show_device_profile(self, profile_request: Awaitable[dict[str, Any]] | None = None) -> None:
         try:
-            me = self.api.auth_me()
+            me = await (profile_request if profile_request is not None else self.api.auth_me())
             sede_id = str(me.get("sede_id") or "")
             if sede_id:
                 self.dashboard.set_device_label(f"sede utente ({sede_id[:8]})")
@@ -718,81 +918,164 @@ class MainWindow(QMainWindow):
         except httpx.HTTPError as exc:
             self.dashboard.set_connection_status("offline/errore", ok=False)
             self.dashboard.set_device_label("errore caricamento profilo")
-            self._show_error(f"Impossibile leggere profilo utente: {exc}")
-
-    def _on_search_requested(self, query: str = "") -> None:
+            await self._show_error(f"Impossibile leggere profilo utente: {exc}")
+
+    def _next_event_id(self) -> str:
+        event_id = self._event_id_pool.popleft() if self._event_id_pool else uuid.uuid4().hex
+        QTimer.singleShot(0, self._refill_event_id_pool)
+        return event_id
+
+    def _refill_event_id_pool(self) -> None:
+        while len(self._event_id_pool) < EVENT_ID_POOL_SIZE:
+            self._event_id_pool.append(uuid.uuid4().hex)
+
+    def _request_search(self, query: str = "") -> None:
+        self._pending_query = query
+        self._search_debounce.start()
+
+    def _run_search(self) -> None:
+        if self._search_task is not None and not self._search_task.done():
+            self._search_task.cancel()
+        self._search_task = self._on_search_requested(self._pending_query)
+
+    @asyncSlot(str)
+    async def _on_search_requested(self, query: str = "") -> None:
+        self._search_seq += 1
+        seq = self._search_seq
         try:
-            rows = self.api.list_bambini_presence_state(limit=300)
-            self.dashboard.set_presence_rows(rows)
-            self.dashboard.set_connection_status("online", ok=True)
+            rows = await self.api.list_bambini_presence_state(limit=300)
         except httpx.HTTPError:
-            self.dashboard.set_connection_status("offline/errore", ok=False)
-            self.dashboard.set_presence_rows([])
+            if seq == self._search_seq:
+                self.dashboard.set_connection_status("offline/errore", ok=False)
+                self.dashboard.set_presence_rows([])
+            return
+        # Una risposta arrivata dopo quella di una ricerca piu' recente non deve sovrascriverne le righe.
+        if seq != self._search_seq:
+            return
+        self.dashboard.set_presence_rows(rows)
+        self.dashboard.set_connection_status("online", ok=True)
+
+    @asyncSlot(str)
+    async def _on_check_in_requested(self, bambino_id: str) -> None:
+        await self._submit_presence_event(bambino_id, "ENTRATA", "/presenze/check-in")
 
-    def _submit_presence_event(self, bambino_id: str, tipo_evento: str, endpoint: str) -> None:
+    @asyncSlot(str)
+    async def _on_check_out_requested(self, bambino_id: str) -> None:
+        await self._submit_presence_event(bambino_id, "USCITA", "/presenze/check-out")
+
+    async def _submit_presence_event(self, bambino_id: str, tipo_evento: str, endpoint: str) -> None:
         payload = {
             "bambino_id": bambino_id,
             "dispositivo_id": VIRTUAL_DEVICE_ID,
-            "client_event_id": str(uuid.uuid4()),
+            "client_event_id": self._next_event_id(),
             "tipo_evento": tipo_evento,
             "timestamp_evento": datetime.now(timezone.utc).isoformat(),
         }
 
         try:
-            self.api.submit_presence_event(endpoint, payload)
+            await self.api.submit_presence_event(endpoint, payload)
             self.dashboard.set_connection_status("online", ok=True)
-            self._show_info(f"{tipo_evento} registrata")
-            self._on_search_requested("")
+            await self._show_info(f"{tipo_evento} registrata")
+            self._request_search("")
         except httpx.HTTPError as exc:
-            self.store.enqueue_event(payload)
-            self.store.mark_event_error(payload["client_event_id"], str(exc))
+            pending_count = await self._store(self.store.enqueue_event, payload, str(exc))
             self.dashboard.set_connection_status("offline/errore", ok=False)
-            self._show_info(f"Rete/API non disponibile: evento salvato offline ({tipo_evento})")
-
-        self.dashboard.set_pending_count(self.store.count_pending())
+            self.dashboard.set_pending_count(pending_count)
+            self._schedule_sync(self._sync_backoff_ms)
+            await self._show_info(f"Rete/API non disponibile: evento salvato offline ({tipo_evento})")
 
-    def _sync_pending(self) -> None:
+    @asyncSlot()
+    async def _sync_pending(self) -> None:
         if self._sync_in_progress:
             return
         self._sync_in_progress = True
-        pending = self.store.list_pending_events(limit=200)
         try:
-            self.dashboard.set_pending_count(len(pending))
-            if not pending:
+            events = await self._store(self.store.list_pending_payloads, SYNC_BATCH_LIMIT)
+            self.dashboard.set_pending_count(self.store.count_pending())
+            if not events:
                 return
 
-            events = [
-                {
-                    "bambino_id": row["bambino_id"],
-                    "dispositivo_id": row["dispositivo_id"],
-                    "client_event_id": row["client_event_id"],
-                    "tipo_evento": row["tipo_evento"],
-                    "timestamp_evento": row["timestamp_evento"],
-                }
-                for row in pending
-            ]
+            chunks = _chunk_events_by_bambino(events, SYNC_CHUNK_SIZE)
+            results = await asyncio.gather(
+                *(self.api.sync_events(chunk) for chunk in chunks),
+                return_exceptions=True,
+            )
+            synced = False
+            failed = False
+            processed_ids: list[str] = []
+            failed_events: list[tuple[str, str]] = []
+            for chunk, result in zip(chunks, results):
+                if isinstance(result, httpx.HTTPError):
+                    error_message = str(result)
+                    failed_events.extend((error_message, event["client_event_id"]) for event in chunk)
+                    failed = True
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                # Gli eventi skip sono idempotenti o invalidi lato server. Li togliamo per evitare loop.
+                processed = chunk[: result["accepted"] + result["skipped"]]
+                processed_ids.extend(event["client_event_id"] for event in processed)
+                synced = True
 
-            try:
-                result = self.api.sync_events(events)
-                accepted = result["accepted"]
-                skipped = result["skipped"]
+            # Rimozioni ed errori di tutti i chunk in una sola transazione sqlite.
+            if processed_ids or failed_events:
+                pending_count = await self._store(self.store.apply_sync_result, processed_ids, failed_events)
+                self.dashboard.set_pending_count(pending_count)
 
-                # Gli eventi skip sono idempotenti o invalidi lato server. Li togliamo per evitare loop.
-                ids_to_remove = [row["client_event_id"] for row in pending][: accepted + skipped]
-                self.store.remove_events(ids_to_remove)
+            if synced:
                 self.dashboard.set_connection_status("online", ok=True)
-                self._on_search_requested("")
-            except httpx.HTTPError as exc:
-                for row in pending:
-                    self.store.mark_event_error(row["client_event_id"], str(exc))
+                self._request_search("")
+            else:
                 self.dashboard.set_connection_status("offline/errore", ok=False)
 
-            self.dashboard.set_pending_count(self.store.count_pending())
+            if failed:
+                self._schedule_sync(self._sync_backoff_ms)
+                self._sync_backoff_ms = min(self._sync_backoff_ms * 2, SYNC_BACKOFF_MAX_MS)
+            else:
+                self._sync_backoff_ms = SYNC_BACKOFF_MIN_MS
+                if len(events) >= SYNC_BATCH_LIMIT:
+                    self._schedule_sync()
         finally:
             self._sync_in_progress = False
 
-    def _show_error(self, message: str) -> None:
-        QMessageBox.critical(self, "Errore", message)
-
-    def _show_info(self, message: str) -> None:
-        QMessageBox.information(self, "Info", message)
+    def _schedule_sync(self, delay_ms: int = 0) -> None:
+        self._sync_due = time.monotonic() + delay_ms / 1000
+        self._background_wakeup.set()
+
+    def _start_background_loop(self) -> None:
+        if self._background_task is None or self._background_task.done():
+            self._background_task = asyncio.ensure_future(self._background_loop())
+
+    def _stop_background_loop(self) -> None:
+        self._sync_due = None
+        if self._background_task is not None:
+            self._background_task.cancel()
+            self._background_task = None
+
+    async def _background_loop(self) -> None:
+        next_health = time.monotonic() + self._health_interval
+        while True:
+            deadline = next_health if self._sync_due is None else min(next_health, self._sync_due)
+            self._background_wakeup.clear()
+            try:
+                # Una sync richiesta nel frattempo sveglia il ciclo e ricalcola la scadenza.
+                await asyncio.wait_for(self._background_wakeup.wait(), max(0.0, deadline - time.monotonic()))
+                continue
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            if self._sync_due is not None and self._sync_due <= now:
+                self._sync_due = None
+                await self._sync_pending()
+            if next_health <= now:
+                # Lo stato rete si vede solo in dashboard: altrove il probe sarebbe lavoro inutile.
+                if self.stack.currentWidget() is self._dashboard:
+                    await self._probe_connection_health()
+                next_health = time.monotonic() + self._health_interval
+
+    # I dialoghi modali girano sul loop Qt tramite asyncWrap, fuori dal task asyncio corrente.
+    async def _show_error(self, message: str) -> None:
+        await asyncWrap(QMessageBox.critical, self, "Errore", message)
+
+    async def _show_info(self, message: str) -> None:
+        await asyncWrap(QMessageBox.information, self, "Info", message)
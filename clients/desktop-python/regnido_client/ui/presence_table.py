@@ -0,0 +1,161 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+from PySide6.QtCore import QAbstractItemModel, QAbstractTableModel, QEvent, QModelIndex, QObject, Qt, Signal
+from PySide6.QtGui import QPainter
+from PySide6.QtWidgets import QApplication, QStyle, QStyledItemDelegate, QStyleOptionButton, QStyleOptionViewItem
+
+BAMBINO_ID_ROLE = Qt.UserRole
+ACTION_ENABLED_ROLE = Qt.UserRole + 1
+PRESENCE_HEADERS = ("Bambino", "Ingresso", "Uscita", "Tempo totale", "Entra", "Esce")
+TOTAL_COLUMN = 3
+ENTER_COLUMN = 4
+EXIT_COLUMN = 5
+
+
+@dataclass(slots=True)
+class PresenceRow:
+    bambino_id: str
+    display_name: str
+    search_key: str
+    ingresso: str
+    uscita: str
+    dentro: bool
+    start_dt: datetime | None
+    closed_seconds: int
+
+
+# Righe presenze come modello: un refresh aggiorna solo le righe cambiate invece di ricreare la tabella.
+class PresenceTableModel(QAbstractTableModel):
+    def __init__(self, format_duration: Callable[[int], str], parent: QObject | None = None) -> None:
+        super().__init__(parent)
+        self._rows: list[PresenceRow] = []
+        self._format_duration = format_duration
+        self._now = datetime.now(timezone.utc)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(PRESENCE_HEADERS)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> Any:
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return PRESENCE_HEADERS[section]
+        return None
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return row.display_name
+            if column == 1:
+                return row.ingresso
+            if column == 2:
+                return row.uscita
+            if column == TOTAL_COLUMN:
+                return self._format_duration(self._total_seconds(row))
+            return "Entra" if column == ENTER_COLUMN else "Esce"
+        if role == BAMBINO_ID_ROLE:
+            return row.bambino_id
+        if role == ACTION_ENABLED_ROLE:
+            if column == ENTER_COLUMN:
+                return not row.dentro
+            if column == EXIT_COLUMN:
+                return row.dentro
+        return None
+
+    def rows(self) -> list[PresenceRow]:
+        return self._rows
+
+    def _total_seconds(self, row: PresenceRow) -> int:
+        if row.dentro and row.start_dt is not None:
+            return row.closed_seconds + max(0, int((self._now - row.start_dt).total_seconds()))
+        return row.closed_seconds
+
+    def tick(self) -> None:
+        # Ogni secondo cambia solo il tempo totale delle righe con un ingresso aperto.
+        self._now = datetime.now(timezone.utc)
+        live = [idx for idx, row in enumerate(self._rows) if row.dentro and row.start_dt is not None]
+        if live:
+            self.dataChanged.emit(self.index(live[0], TOTAL_COLUMN), self.index(live[-1], TOTAL_COLUMN), [Qt.DisplayRole])
+
+    def update(self, rows: list[PresenceRow]) -> None:
+        self._now = datetime.now(timezone.utc)
+        keep = {row.bambino_id for row in rows}
+        # Rimozioni dal basso, a blocchi contigui, cosi' gli indici ancora da visitare non si spostano.
+        idx = len(self._rows) - 1
+        while idx >= 0:
+            if self._rows[idx].bambino_id in keep:
+                idx -= 1
+                continue
+            last = idx
+            while idx >= 0 and self._rows[idx].bambino_id not in keep:
+                idx -= 1
+            self.beginRemoveRows(QModelIndex(), idx + 1, last)
+            del self._rows[idx + 1 : last + 1]
+            self.endRemoveRows()
+
+        if not self._rows:
+            self.beginResetModel()
+            self._rows = list(rows)
+            self.endResetModel()
+            return
+
+        present = {row.bambino_id for row in self._rows}
+        for idx, row in enumerate(rows):
+            if row.bambino_id not in present:
+                self.beginInsertRows(QModelIndex(), idx, idx)
+                self._rows.insert(idx, row)
+                self.endInsertRows()
+                continue
+            if self._rows[idx].bambino_id != row.bambino_id:
+                # Ordine cambiato: caso raro, si ricostruisce tutto.
+                self.beginResetModel()
+                self._rows = list(rows)
+                self.endResetModel()
+                return
+            if self._rows[idx] != row:
+                self._rows[idx] = row
+                self.dataChanged.emit(self.index(idx, 0), self.index(idx, len(PRESENCE_HEADERS) - 1))
+
+
+# Disegna i pulsanti Entra/Esce direttamente nella cella: nessun QPushButton per riga.
+class PresenceButtonDelegate(QStyledItemDelegate):
+    clicked = Signal(str)
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex) -> None:
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = str(index.data(Qt.DisplayRole) or "")
+        button.state = QStyle.State_Raised
+        if index.data(ACTION_ENABLED_ROLE):
+            button.state |= QStyle.State_Enabled
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        style.drawControl(QStyle.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(
+        self,
+        event: QEvent,
+        model: QAbstractItemModel,
+        option: QStyleOptionViewItem,
+        index: QModelIndex,
+    ) -> bool:
+        if event.type() != QEvent.MouseButtonRelease or event.button() != Qt.LeftButton:
+            return False
+        if not index.data(ACTION_ENABLED_ROLE):
+            return False
+        if not option.rect.contains(event.position().toPoint()):
+            return False
+        self.clicked.emit(str(index.data(BAMBINO_ID_ROLE) or ""))
+        return True
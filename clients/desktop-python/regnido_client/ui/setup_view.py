@@ -8,12 +8,14 @@ from PySide6.QtWidgets import (
     QHBoxLayout,
     QLabel,
     QLineEdit,
+    QPlainTextEdit,
     QPushButton,
-    QTextEdit,
     QVBoxLayout,
     QWidget,
 )
 
+from regnido_client.config import LOG_MAX_BLOCKS
+
 
 class SetupView(QWidget):
     save_requested = Signal(str)
@@ -44,27 +46,16 @@ class SetupView(QWidget):
         self.admin_login_button = QPushButton("Login admin")
         self.admin_status_label = QLabel("Admin non autenticato")
 
-        self.sede_nome_input = QLineEdit()
-        self.refresh_sedi_button = QPushButton("Aggiorna sedi")
-        self.create_sede_button = QPushButton("Crea sede")
-        self.last_sede_id_label = QLabel("-")
-
-        self.bambino_sede_combo = QComboBox()
-        self.bambino_nome_input = QLineEdit()
-        self.bambino_cognome_input = QLineEdit()
-        self.bambino_attivo_checkbox = QCheckBox("Attivo")
-        self.bambino_attivo_checkbox.setChecked(True)
-        self.create_bambino_button = QPushButton("Crea bambino")
-
-        self.admin_output = QTextEdit()
+        self.admin_output = QPlainTextEdit()
         self.admin_output.setReadOnly(True)
+        self.admin_output.setMaximumBlockCount(LOG_MAX_BLOCKS)
+        # Form sedi/bambini costruiti solo al primo login admin: l'operatore non li usa mai.
+        self._provisioning: QWidget | None = None
+        self._sedi: list[tuple[str, str]] = []
 
         self.test_button.clicked.connect(self._emit_test)
         self.save_button.clicked.connect(self._emit_save)
         self.admin_login_button.clicked.connect(self._emit_admin_login)
-        self.refresh_sedi_button.clicked.connect(self.admin_refresh_sedi_requested)
-        self.create_sede_button.clicked.connect(self._emit_admin_create_sede)
-        self.create_bambino_button.clicked.connect(self._emit_admin_create_bambino)
 
         root = QVBoxLayout()
         root.addWidget(self._build_operator_group())
@@ -72,8 +63,6 @@ class SetupView(QWidget):
         root.addStretch(1)
         self.setLayout(root)
 
-        self.set_admin_enabled(False)
-
     def _build_operator_group(self) -> QGroupBox:
         group = QGroupBox("Configurazione iniziale backend")
         form = QFormLayout()
@@ -109,6 +98,33 @@ class SetupView(QWidget):
         auth_row.addWidget(self.admin_status_label)
         auth_row.addStretch(1)
 
+        self._admin_wrap = QVBoxLayout()
+        self._admin_wrap.addLayout(auth_form)
+        self._admin_wrap.addLayout(auth_row)
+        self._admin_wrap.addWidget(self.admin_output)
+
+        group.setLayout(self._admin_wrap)
+        return group
+
+    def _ensure_provisioning(self) -> None:
+        if self._provisioning is not None:
+            return
+        self.sede_nome_input = QLineEdit()
+        self.refresh_sedi_button = QPushButton("Aggiorna sedi")
+        self.create_sede_button = QPushButton("Crea sede")
+        self.last_sede_id_label = QLabel("-")
+
+        self.bambino_sede_combo = QComboBox()
+        self.bambino_nome_input = QLineEdit()
+        self.bambino_cognome_input = QLineEdit()
+        self.bambino_attivo_checkbox = QCheckBox("Attivo")
+        self.bambino_attivo_checkbox.setChecked(True)
+        self.create_bambino_button = QPushButton("Crea bambino")
+
+        self.refresh_sedi_button.clicked.connect(self.admin_refresh_sedi_requested)
+        self.create_sede_button.clicked.connect(self._emit_admin_create_sede)
+        self.create_bambino_button.clicked.connect(self._emit_admin_create_bambino)
+
         sede_form = QFormLayout()
         sede_form.addRow("Nome sede", self.sede_nome_input)
         sede_form.addRow("Ultima sede ID", self.last_sede_id_label)
@@ -126,20 +142,22 @@ class SetupView(QWidget):
         actions.addStretch(1)
 
         wrap = QVBoxLayout()
-        wrap.addLayout(auth_form)
-        wrap.addLayout(auth_row)
+        wrap.setContentsMargins(0, 0, 0, 0)
         wrap.addLayout(sede_form)
         wrap.addLayout(bambino_form)
         wrap.addLayout(actions)
-        wrap.addWidget(self.admin_output)
-
-        group.setLayout(wrap)
-        return group
+        self._provisioning = QWidget()
+        self._provisioning.setLayout(wrap)
+        self._admin_wrap.insertWidget(self._admin_wrap.indexOf(self.admin_output), self._provisioning)
 
     def set_values(self, api_base_url: str) -> None:
         self.api_input.setText(api_base_url)
 
     def set_admin_enabled(self, enabled: bool) -> None:
+        if enabled:
+            self._ensure_provisioning()
+        elif self._provisioning is None:
+            return
         self.refresh_sedi_button.setEnabled(enabled)
         self.create_sede_button.setEnabled(enabled)
         self.create_bambino_button.setEnabled(enabled)
@@ -150,16 +168,27 @@ class SetupView(QWidget):
         self.admin_status_label.setText(message)
 
     def append_admin_output(self, text: str) -> None:
-        self.admin_output.append(text)
-        self.admin_output.append("-" * 45)
+        self.admin_output.appendPlainText(f"{text}\n{'-' * 45}")
 
     def set_sedi(self, sedi: list[tuple[str, str]]) -> None:
+        self._ensure_provisioning()
+        # Elenco invariato dopo un refresh: la combo resta com'e', selezione compresa.
+        if sedi == self._sedi:
+            return
+        self._sedi = list(sedi)
+        selected: str = self.bambino_sede_combo.currentData() or ""
         self.bambino_sede_combo.clear()
         for sede_id, sede_nome in sedi:
-            label = f"{sede_nome} ({sede_id[:8]})"
-            self.bambino_sede_combo.addItem(label, sede_id)
+            self.bambino_sede_combo.addItem(f"{sede_nome} ({sede_id[:8]})", sede_id)
+        if selected:
+            self.select_sede(selected)
+
+    def set_last_sede_id(self, sede_id: str) -> None:
+        self._ensure_provisioning()
+        self.last_sede_id_label.setText(sede_id)
 
     def select_sede(self, sede_id: str) -> None:
+        self._ensure_provisioning()
         idx_b = self.bambino_sede_combo.findData(sede_id)
         if idx_b >= 0:
             self.bambino_sede_combo.setCurrentIndex(idx_b)
@@ -192,9 +221,9 @@ class SetupView(QWidget):
         self.admin_create_sede_requested.emit(self.sede_nome_input.text().strip())
 
     def _emit_admin_create_bambino(self) -> None:
-        sede_id = self.bambino_sede_combo.currentData()
+        sede_id: str = self.bambino_sede_combo.currentData() or ""
         self.admin_create_bambino_requested.emit(
-            str(sede_id) if sede_id else "",
+            sede_id,
             self.bambino_nome_input.text().strip(),
             self.bambino_cognome_input.text().strip(),
             self.bambino_attivo_checkbox.isChecked(),
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import queue
+import threading
+from collections import deque
+from typing import Any
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from app.db import SessionLocal
+from app.models import AuditLog
+
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_SECONDS = 2.0
+AUDIT_SESSION_KEY = "audit_rows"
+AUDIT_MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+_audit_queue: "queue.SimpleQueue[dict[str, Any]]" = queue.SimpleQueue()
+# Batch non scritti, con il numero di tentativi: un errore transitorio del database non perde l'audit.
+_failed_batches: deque[tuple[int, list[dict[str, Any]]]] = deque()
+_flush_lock = threading.Lock()
+
+
+# Le righe audit restano nella sessione fino al commit: se la transazione fallisce non vengono scritte.
+@event.listens_for(Session, "after_commit")
+def _enqueue_committed_audit(session: Session) -> None:
+    for row in session.info.pop(AUDIT_SESSION_KEY, ()):
+        _audit_queue.put(row)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_audit(session: Session) -> None:
+    session.info.pop(AUDIT_SESSION_KEY, None)
+
+
+def _write_batch(batch: list[dict[str, Any]]) -> None:
+    with SessionLocal() as db:
+        db.execute(insert(AuditLog), batch)
+        db.commit()
+
+
+def _retry_failed_batches(final: bool) -> tuple[int, bool]:
+    written = 0
+    while _failed_batches:
+        attempts, batch = _failed_batches[0]
+        try:
+            _write_batch(batch)
+        except Exception:
+            attempts += 1
+            if attempts < AUDIT_MAX_ATTEMPTS and not final:
+                _failed_batches[0] = (attempts, batch)
+                logger.warning("Scrittura audit fallita (tentativo %d), %d righe in attesa", attempts, len(batch))
+                return written, False
+            _failed_batches.popleft()
+            logger.exception("Scrittura audit fallita dopo %d tentativi: %d righe perse", attempts, len(batch))
+            continue
+        _failed_batches.popleft()
+        written += len(batch)
+    return written, True
+
+
+def flush_audit_queue(final: bool = False) -> int:
+    with _flush_lock:
+        # Prima i batch falliti, in ordine: se il database e' ancora giu' si riprova al ciclo successivo.
+        written, healthy = _retry_failed_batches(final)
+        if not healthy:
+            return written
+        while True:
+            batch: list[dict[str, Any]] = []
+            while len(batch) < AUDIT_BATCH_SIZE:
+                try:
+                    batch.append(_audit_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return written
+            try:
+                _write_batch(batch)
+            except Exception:
+                _failed_batches.append((0, batch))
+                retried, healthy = _retry_failed_batches(final)
+                written += retried
+                if not healthy:
+                    return written
+                continue
+            written += len(batch)
+
+
+async def flush_audit_loop() -> None:
+    while True:
+        await asyncio.sleep(AUDIT_FLUSH_SECONDS)
+        await asyncio.to_thread(flush_audit_queue)
@@ -1,4 +1,9 @@
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from datetime import timedelta
+from functools import cached_property, lru_cache
+from typing import Annotated
+
+from pydantic import field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -6,14 +11,43 @@ class Settings(BaseSettings):
 
     app_env: str = "development"
     database_url: str = "postgresql+psycopg://regnido_user:change-me-db-password@db:5432/regnido"
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout_seconds: int = 5
+    db_pool_recycle_seconds: int = 1800
     secret_key: str = "change-me-in-production"
+    # Chiave HMAC dei codici di attivazione dispositivo; vuota = secret_key.
+    server_code_hmac_key: str = ""
     access_token_expire_minutes: int = 60
     jwt_leeway_seconds: int = 300
-    cors_origins: str = "*"
+    # Da env come elenco separato da virgole, parsato una volta all'avvio.
+    cors_origins: Annotated[list[str], NoDecode] = ["*"]
 
     bootstrap_admin_username: str = ""
     bootstrap_admin_password: str = ""
     bootstrap_admin_full_name: str = ""
 
+    @field_validator("cors_origins", mode="before")
+    @classmethod
+    def _split_cors_origins(cls, value: object) -> object:
+        if isinstance(value, str):
+            return [origin.strip() for origin in value.split(",") if origin.strip()] or ["*"]
+        return value
+
+    @cached_property
+    def activation_code_key(self) -> bytes:
+        return (self.server_code_hmac_key or self.secret_key).encode("utf-8")
+
+    @cached_property
+    def access_token_expire(self) -> timedelta:
+        return timedelta(minutes=self.access_token_expire_minutes)
+
+
+# Letta una sola volta per processo (.env + ambiente); i moduli usano l'alias `settings`,
+# get_settings resta disponibile come dipendenza FastAPI sovrascrivibile nei test.
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    return Settings()
+
 
-settings = Settings()
+settings = get_settings()
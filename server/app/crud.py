@@ -3,10 +3,11 @@ from datetime import datetime, timezone
 
 from fastapi import HTTPException
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
 
+from app.audit import AUDIT_SESSION_KEY
 from app.models import (
-    AuditLog,
     Bambino,
     Dispositivo,
     Permission,
@@ -19,9 +20,13 @@ from app.models import (
     UserKeyStatus,
     UserRole,
     Utente,
+    uuid7,
 )
+from app.schemas import PresenceEventIn
 from app.security import hash_password, verify_password
 
+PRESENCE_INSERT_CHUNK = 1000
+
 
 def seed_roles_permissions(db: Session) -> None:
     existing = db.scalar(select(Role.id))
@@ -76,7 +81,9 @@ def bootstrap_admin_if_needed(db: Session, username: str, password: str, full_na
 
 
 def authenticate_user(db: Session, username: str, password: str) -> Utente:
-    user = db.scalar(select(Utente).where(Utente.username == username, Utente.attivo.is_(True)))
+    user = db.scalar(
+        select(Utente).options(joinedload(Utente.ruolo)).where(Utente.username == username, Utente.attivo.is_(True))
+    )
     if not user or not verify_password(password, user.password_hash):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
     now = datetime.now(timezone.utc)
@@ -105,57 +112,57 @@ def append_audit(
     ip: str | None = None,
     device_id: str | None = None,
 ) -> None:
-    db.add(
-        AuditLog(
-            utente_id=utente_id,
-            dispositivo_id=dispositivo_id,
-            azione=azione,
-            entita=entita,
-            entita_id=entita_id,
-            dettagli_json=dettagli,
-            esito=esito,
-            ip=ip,
-            device_id=device_id,
-        )
+    # Accodata alla sessione: app.audit la scrive in batch dopo il commit.
+    db.info.setdefault(AUDIT_SESSION_KEY, []).append(
+        {
+            "timestamp": datetime.utcnow(),
+            "utente_id": utente_id,
+            "dispositivo_id": dispositivo_id,
+            "azione": azione,
+            "entita": entita,
+            "entita_id": entita_id,
+            "dettagli_json": dettagli,
+            "esito": esito,
+            "ip": ip,
+            "device_id": device_id,
+        }
     )
 
 
 
-def create_presence_event(
+def _user_fallback_device(db: Session, user_id: uuid.UUID) -> Dispositivo:
+    user = db.scalar(select(Utente).where(Utente.id == user_id, Utente.attivo.is_(True)))
+    if not user or not user.sede_id:
+        raise HTTPException(status_code=400, detail="Utente non associato a una sede")
+    sede = db.scalar(select(Sede).where(Sede.id == user.sede_id, Sede.attiva.is_(True)))
+    if not sede:
+        raise HTTPException(status_code=404, detail="Sede utente non trovata o disattivata")
+    dispositivo = db.scalar(
+        select(Dispositivo)
+        .where(Dispositivo.sede_id == sede.id, Dispositivo.attivo.is_(True))
+        .order_by(Dispositivo.created_at.asc())
+    )
+    if not dispositivo:
+        dispositivo = Dispositivo(nome=f"Virtuale-{str(sede.id)[:8]}", sede_id=sede.id, attivo=True)
+        db.add(dispositivo)
+        db.flush()
+    return dispositivo
+
+
+def _checked_presence_device(
     db: Session,
     *,
     tipo: PresenceEventType,
     bambino_id: uuid.UUID,
     dispositivo_id: uuid.UUID | None,
-    client_event_id: uuid.UUID,
-    timestamp_evento: datetime,
     creato_da: uuid.UUID,
-) -> Presenza:
-    existing = db.scalar(select(Presenza).where(Presenza.client_event_id == client_event_id))
-    if existing:
-        return existing
-
+) -> Dispositivo:
     dispositivo = None
     if dispositivo_id:
         dispositivo = db.scalar(select(Dispositivo).where(Dispositivo.id == dispositivo_id, Dispositivo.attivo.is_(True)))
 
     if not dispositivo:
-        user = db.scalar(select(Utente).where(Utente.id == creato_da, Utente.attivo.is_(True)))
-        if not user or not user.sede_id:
-            raise HTTPException(status_code=400, detail="Utente non associato a una sede")
-        sede = db.scalar(select(Sede).where(Sede.id == user.sede_id, Sede.attiva.is_(True)))
-        if not sede:
-            raise HTTPException(status_code=404, detail="Sede utente non trovata o disattivata")
-        dispositivo = db.scalar(
-            select(Dispositivo)
-            .where(Dispositivo.sede_id == sede.id, Dispositivo.attivo.is_(True))
-            .order_by(Dispositivo.created_at.asc())
-        )
-        if not dispositivo:
-            dispositivo = Dispositivo(nome=f"Virtuale-{str(sede.id)[:8]}", sede_id=sede.id, attivo=True)
-            db.add(dispositivo)
-            db.flush()
-        dispositivo_id = dispositivo.id
+        dispositivo = _user_fallback_device(db, creato_da)
 
     bambino = db.scalar(
         select(Bambino).where(
@@ -167,30 +174,62 @@ def create_presence_event(
     if not bambino:
         raise HTTPException(status_code=404, detail="Bambino non trovato nella sede del dispositivo")
 
-    latest = db.scalar(
-        select(Presenza)
+    latest_tipo = db.scalar(
+        select(Presenza.tipo_evento)
         .where(Presenza.bambino_id == bambino_id, Presenza.sede_id == dispositivo.sede_id)
         .order_by(Presenza.timestamp_evento.desc())
+        .limit(1)
     )
 
-    if latest and latest.tipo_evento == tipo:
+    if latest_tipo == tipo:
         raise HTTPException(status_code=400, detail=f"Evento consecutivo non valido: {tipo.value}")
 
-    if tipo == PresenceEventType.USCITA and (not latest or latest.tipo_evento != PresenceEventType.ENTRATA):
+    if tipo == PresenceEventType.USCITA and latest_tipo != PresenceEventType.ENTRATA:
         raise HTTPException(status_code=400, detail="USCITA senza ENTRATA aperta")
+    return dispositivo
+
+
+def create_presence_event(
+    db: Session,
+    *,
+    tipo: PresenceEventType,
+    bambino_id: uuid.UUID,
+    dispositivo_id: uuid.UUID | None,
+    client_event_id: uuid.UUID,
+    timestamp_evento: datetime,
+    creato_da: uuid.UUID,
+) -> Presenza:
+    existing_query = select(Presenza).where(Presenza.client_event_id == client_event_id)
+    try:
+        dispositivo = _checked_presence_device(
+            db, tipo=tipo, bambino_id=bambino_id, dispositivo_id=dispositivo_id, creato_da=creato_da
+        )
+    except HTTPException:
+        # Reinvio di un evento gia' registrato: resta idempotente anche se lo stato ora lo rifiuterebbe.
+        existing = db.scalar(existing_query)
+        if existing:
+            return existing
+        raise
 
-    presenza = Presenza(
-        bambino_id=bambino_id,
-        sede_id=dispositivo.sede_id,
-        dispositivo_id=dispositivo_id,
-        tipo_evento=tipo,
-        timestamp_evento=timestamp_evento,
-        creato_da=creato_da,
-        client_event_id=client_event_id,
-        synced_at=datetime.now(timezone.utc),
+    # Niente SELECT preventiva: un client_event_id gia' presente non inserisce nulla e si rilegge la riga.
+    presenza = db.scalar(
+        pg_insert(Presenza)
+        .values(
+            id=uuid7(),
+            bambino_id=bambino_id,
+            sede_id=dispositivo.sede_id,
+            dispositivo_id=dispositivo.id,
+            tipo_evento=tipo,
+            timestamp_evento=timestamp_evento,
+            creato_da=creato_da,
+            client_event_id=client_event_id,
+            synced_at=datetime.now(timezone.utc),
+        )
+        .on_conflict_do_nothing(index_elements=["client_event_id"])
+        .returning(Presenza)
     )
-    db.add(presenza)
-    db.flush()
+    if presenza is None:
+        return db.scalars(existing_query).one()
 
     append_audit(
         db,
@@ -199,7 +238,121 @@ def create_presence_event(
         entita_id=str(presenza.id),
         esito="OK",
         utente_id=creato_da,
-        dispositivo_id=dispositivo_id,
+        dispositivo_id=dispositivo.id,
         dettagli={"bambino_id": str(bambino_id), "sede_id": str(dispositivo.sede_id)},
     )
     return presenza
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def create_presence_events(db: Session, events: list[PresenceEventIn], creato_da: uuid.UUID) -> tuple[int, int]:
+    # Stesse regole di create_presence_event, ma con poche query per l'intero batch invece che per evento.
+    if not events:
+        return 0, 0
+
+    seen = set(
+        db.scalars(
+            select(Presenza.client_event_id).where(Presenza.client_event_id.in_({e.client_event_id for e in events}))
+        )
+    )
+    device_ids = {e.dispositivo_id for e in events if e.dispositivo_id}
+    devices = {
+        d.id: d
+        for d in db.scalars(select(Dispositivo).where(Dispositivo.id.in_(device_ids), Dispositivo.attivo.is_(True)))
+    }
+    fallback: Dispositivo | None = None
+    if any(e.client_event_id not in seen and e.dispositivo_id not in devices for e in events):
+        try:
+            fallback = _user_fallback_device(db, creato_da)
+        except HTTPException:
+            fallback = None
+
+    bambino_ids = {e.bambino_id for e in events}
+    bambini = dict(
+        db.execute(select(Bambino.id, Bambino.sede_id).where(Bambino.id.in_(bambino_ids), Bambino.attivo.is_(True))).all()
+    )
+    # Ultimo evento per (bambino, sede): DISTINCT ON ordinato per timestamp.
+    latest = {
+        (row.bambino_id, row.sede_id): (row.tipo_evento, _as_utc(row.timestamp_evento))
+        for row in db.execute(
+            select(Presenza.bambino_id, Presenza.sede_id, Presenza.tipo_evento, Presenza.timestamp_evento)
+            .where(Presenza.bambino_id.in_(bambino_ids))
+            .distinct(Presenza.bambino_id, Presenza.sede_id)
+            .order_by(Presenza.bambino_id, Presenza.sede_id, Presenza.timestamp_evento.desc())
+        )
+    }
+
+    accepted = 0
+    skipped = 0
+    rows: list[dict] = []
+    synced_at = datetime.now(timezone.utc)
+    for event in events:
+        if event.client_event_id in seen:
+            accepted += 1
+            continue
+        dispositivo = devices.get(event.dispositivo_id) or fallback
+        sede_id = bambini.get(event.bambino_id)
+        if dispositivo is None or sede_id != dispositivo.sede_id:
+            skipped += 1
+            continue
+        tipo = event.tipo_evento or PresenceEventType.ENTRATA
+        previous = latest.get((event.bambino_id, sede_id))
+        if previous and previous[0] == tipo:
+            skipped += 1
+            continue
+        if tipo == PresenceEventType.USCITA and (not previous or previous[0] != PresenceEventType.ENTRATA):
+            skipped += 1
+            continue
+
+        when = _as_utc(event.timestamp_evento)
+        if previous is None or when >= previous[1]:
+            latest[(event.bambino_id, sede_id)] = (tipo, when)
+        seen.add(event.client_event_id)
+        accepted += 1
+        rows.append(
+            {
+                "id": uuid7(),
+                "bambino_id": event.bambino_id,
+                "sede_id": sede_id,
+                "dispositivo_id": dispositivo.id,
+                "tipo_evento": tipo,
+                "timestamp_evento": event.timestamp_evento,
+                "creato_da": creato_da,
+                "client_event_id": event.client_event_id,
+                "synced_at": synced_at,
+            }
+        )
+
+    inserted: set[uuid.UUID] = set()
+    for start in range(0, len(rows), PRESENCE_INSERT_CHUNK):
+        # Un sync concorrente puo' aver gia' inserito lo stesso client_event_id: la riga viene saltata.
+        inserted.update(
+            db.scalars(
+                pg_insert(Presenza)
+                .values(rows[start : start + PRESENCE_INSERT_CHUNK])
+                .on_conflict_do_nothing(index_elements=["client_event_id"])
+                .returning(Presenza.id)
+            )
+        )
+    # Una sola riga audit per batch: gli eventi restano tracciati dagli id in dettagli.
+    if inserted:
+        append_audit(
+            db,
+            azione="presence:sync",
+            entita="presenze",
+            esito="OK",
+            utente_id=creato_da,
+            dettagli={
+                "count": len(inserted),
+                "skipped": skipped,
+                "eventi": [
+                    {"id": str(row["id"]), "bambino_id": str(row["bambino_id"]), "tipo": row["tipo_evento"].value}
+                    for row in rows
+                    if row["id"] in inserted
+                ],
+            },
+        )
+    return accepted, skipped
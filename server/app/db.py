@@ -4,7 +4,15 @@ from sqlalchemy.orm import declarative_base, sessionmaker
 from app.config import settings
 
 
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+# Pool esplicito: connessioni riusate tra richieste, attesa breve se il pool e' esaurito.
+engine = create_engine(
+    settings.database_url,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout_seconds,
+    pool_recycle=settings.db_pool_recycle_seconds,
+    pool_pre_ping=True,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
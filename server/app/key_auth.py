@@ -1,9 +1,10 @@
 import base64
 import hashlib
-import json
 import uuid
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
+import orjson
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
 from cryptography.hazmat.primitives.serialization import (
@@ -71,7 +72,19 @@ def build_key_file_payload(
         "expires_at": valid_to.isoformat() if valid_to else None,
         "encrypted_private_key_pem": encrypted_private_key_pem,
     }
-    return json.dumps(payload, indent=2, ensure_ascii=False)
+    # Indentato: il file chiave puo' essere aperto a mano dall'amministratore.
+    return orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode("utf-8")
+
+
+# Il parsing PEM costa piu' della verifica Ed25519: la chiave pubblica si decodifica una volta sola.
+# Il PEM di una chiave non cambia mai, la revoca si controlla a DB prima della verifica.
+@lru_cache(maxsize=1024)
+def _load_ed25519_public_key(public_key_pem: str) -> Ed25519PublicKey | None:
+    try:
+        public_key = serialization.load_pem_public_key(public_key_pem.encode("utf-8"))
+    except ValueError:
+        return None
+    return public_key if isinstance(public_key, Ed25519PublicKey) else None
 
 
 def verify_signature(public_key_pem: str, challenge: str, signature_b64: str) -> bool:
@@ -79,10 +92,10 @@ def verify_signature(public_key_pem: str, challenge: str, signature_b64: str) ->
         signature = base64.b64decode(signature_b64.encode("utf-8"), validate=True)
     except Exception:
         return False
+    public_key = _load_ed25519_public_key(public_key_pem)
+    if public_key is None:
+        return False
     try:
-        public_key = serialization.load_pem_public_key(public_key_pem.encode("utf-8"))
-        if not isinstance(public_key, Ed25519PublicKey):
-            return False
         public_key.verify(signature, challenge.encode("utf-8"))
         return True
     except Exception:
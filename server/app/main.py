@@ -1,22 +1,36 @@
+import asyncio
+import hashlib
+import hmac
+import logging
 import secrets
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta, timezone
 from io import BytesIO
 
-from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import func, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload
 
+from app.audit import flush_audit_loop, flush_audit_queue
 from app.config import settings
 from app.crud import (
     append_audit,
     authenticate_user,
     bootstrap_admin_if_needed,
     create_presence_event,
+    create_presence_events,
     seed_roles_permissions,
 )
 from app.db import Base, SessionLocal, engine, get_db
@@ -78,23 +92,55 @@ from app.schemas import (
     UserKeyRevokeIn,
     UserOut,
 )
-from app.security import create_access_token, hash_password, verify_password
+from app.security import activation_code_lookup, create_access_token, hash_password, verify_password
 
 
-app = FastAPI(title="RegNido API", version="0.1.0")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="RegNido API", version="0.1.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[x.strip() for x in settings.cors_origins.split(",") if x.strip()] or ["*"],
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Before"],
 )
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     Base.metadata.create_all(bind=engine)
+    # create_all non aggiunge colonne ne' indici a tabelle gia' esistenti.
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE device_activations ADD COLUMN IF NOT EXISTS code_lookup VARCHAR(64)"))
+        conn.execute(text("ALTER TABLE device_activations ALTER COLUMN code_hash DROP NOT NULL"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_device_activations_code_lookup "
+                "ON device_activations (code_lookup)"
+            )
+        )
+        conn.execute(text("DROP INDEX IF EXISTS ix_audit_log_timestamp"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_audit_log_timestamp_id ON audit_log (timestamp, id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_bambini_sede_attivo ON bambini (sede_id, attivo)"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_presenze_child_sede_ts "
+                "ON presenze (bambino_id, sede_id, timestamp_evento DESC)"
+            )
+        )
+    # Indici trigram per la ricerca ILIKE '%q%' su nome/cognome; senza pg_trgm la ricerca resta un seq scan.
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_bambini_nome_trgm ON bambini USING gin (nome gin_trgm_ops)"))
+            conn.execute(
+                text("CREATE INDEX IF NOT EXISTS ix_bambini_cognome_trgm ON bambini USING gin (cognome gin_trgm_ops)")
+            )
+    except SQLAlchemyError as exc:
+        logger.warning("Indici trigram non creati, la ricerca per nome usera' scansioni sequenziali: %s", exc)
     with SessionLocal() as db:
         seed_roles_permissions(db)
         bootstrap_admin_if_needed(
@@ -106,14 +152,74 @@ def on_startup() -> None:
         db.commit()
 
 
-def get_current_user(authorization: str = Header(default=""), db: Session = Depends(get_db)) -> Utente:
-    if not authorization.startswith("Bearer "):
+_audit_task: asyncio.Task[None] | None = None
+
+
+@app.on_event("startup")
+async def start_audit_flush() -> None:
+    global _audit_task
+    _audit_task = asyncio.create_task(flush_audit_loop())
+
+
+@app.on_event("shutdown")
+async def stop_audit_flush() -> None:
+    if _audit_task is not None:
+        _audit_task.cancel()
+    # Ultimo flush: cio' che non si riesce a scrivere ora viene registrato come perso nel log.
+    await asyncio.to_thread(flush_audit_queue, final=True)
+
+
+# auto_error=False: senza token si risponde 401 come prima, non il 403 di default di HTTPBearer.
+bearer_scheme = HTTPBearer(auto_error=False)
+
+USER_CACHE_TTL_SECONDS = 5.0
+USER_CACHE_MAX_ENTRIES = 10_000
+
+
+# Istantanea immutabile dell'utente autenticato: condivisibile tra richieste, nessun oggetto ORM in cache.
+@dataclass(frozen=True, slots=True)
+class CurrentUser:
+    id: uuid.UUID
+    username: str
+    sede_id: uuid.UUID | None
+    role: UserRole
+    attivo: bool
+
+
+# Token -> utente gia' verificato, per pochi secondi: evita la query utente a ogni richiesta.
+_user_cache: OrderedDict[bytes, tuple[float, CurrentUser]] = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+
+def invalidate_user_cache(user_id: uuid.UUID | None = None) -> None:
+    with _user_cache_lock:
+        if user_id is None:
+            _user_cache.clear()
+            return
+        for key in [key for key, (_, cached) in _user_cache.items() if cached.id == user_id]:
+            del _user_cache[key]
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials | None = Depends(bearer_scheme),
+    db: Session = Depends(get_db),
+) -> CurrentUser:
+    if credentials is None:
         raise HTTPException(status_code=401, detail="Token mancante")
 
-    token = authorization.replace("Bearer ", "", 1)
+    cache_key = hashlib.blake2b(credentials.credentials.encode("utf-8"), digest_size=16).digest()
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(cache_key)
+        if entry is not None:
+            if entry[0] > now:
+                _user_cache.move_to_end(cache_key)
+                return entry[1]
+            del _user_cache[cache_key]
+
     try:
         payload = jwt.decode(
-            token,
+            credentials.credentials,
             settings.secret_key,
             algorithms=["HS256"],
             options={"leeway": settings.jwt_leeway_seconds},
@@ -123,35 +229,49 @@ def get_current_user(authorization: str = Header(default=""), db: Session = Depe
     except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Token non valido") from None
 
-    user = db.scalar(select(Utente).where(Utente.id == user_uuid, Utente.attivo.is_(True)))
-    if not user:
+    row = db.execute(
+        select(Utente.id, Utente.username, Utente.sede_id, Role.code, Utente.attivo)
+        .join(Role, Role.id == Utente.ruolo_id)
+        .where(Utente.id == user_uuid, Utente.attivo.is_(True))
+    ).first()
+    if not row:
         raise HTTPException(status_code=401, detail="Utente non trovato")
+    user = CurrentUser(*row)
+
+    # La voce non sopravvive al token: scadenza JWT (con la tolleranza) convertita sull'orologio monotono.
+    token_ttl = float(payload.get("exp", 0)) + settings.jwt_leeway_seconds - time.time()
+    with _user_cache_lock:
+        _user_cache[cache_key] = (now + min(USER_CACHE_TTL_SECONDS, token_ttl), user)
+        if len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
     return user
 
 
-def get_admin_user(user: Utente = Depends(get_current_user)) -> Utente:
-    if not user.ruolo or user.ruolo.code != UserRole.AMM_CENTRALE:
+def get_admin_user(user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
+    if user.role != UserRole.AMM_CENTRALE:
         raise HTTPException(status_code=403, detail="Permessi insufficienti")
     return user
 
 
-def user_groups(user: Utente) -> list[str]:
-    if user.ruolo and user.ruolo.code == UserRole.AMM_CENTRALE:
+def user_groups(role: UserRole) -> list[str]:
+    if role == UserRole.AMM_CENTRALE:
         return ["admin"]
     return ["educatore"]
 
 
-def has_global_sedi_access(user: Utente) -> bool:
-    role_is_admin = bool(user.ruolo and user.ruolo.code == UserRole.AMM_CENTRALE)
+def has_global_sedi_access(user: CurrentUser) -> bool:
+    role_is_admin = user.role == UserRole.AMM_CENTRALE
     username_is_admin = user.username.strip().lower() == "admin"
     return role_is_admin or username_is_admin
 
 
+ACTIVATION_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+
 def generate_activation_code() -> str:
-    alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-    chunk_a = "".join(secrets.choice(alphabet) for _ in range(4))
-    chunk_b = "".join(secrets.choice(alphabet) for _ in range(4))
-    return f"{chunk_a}-{chunk_b}"
+    # Alfabeto di 32 simboli: 5 bit per byte senza bias, una sola lettura di entropia.
+    chars = "".join(ACTIVATION_CODE_ALPHABET[b & 0x1F] for b in secrets.token_bytes(8))
+    return f"{chars[:4]}-{chars[4:]}"
 
 
 def normalize_activation_code(code: str) -> str:
@@ -191,7 +311,7 @@ def parse_period_bounds(unita: str, periodo: str) -> tuple[datetime, datetime]:
     raise HTTPException(status_code=400, detail="Unita temporale non valida: usare 'giorno' o 'mese'")
 
 
-def allowed_sedi_for_user(db: Session, user: Utente) -> list[Sede]:
+def allowed_sedi_for_user(db: Session, user: CurrentUser) -> list[Sede]:
     if has_global_sedi_access(user):
         return db.scalars(select(Sede).order_by(Sede.nome.asc())).all()
     if not user.sede_id:
@@ -206,6 +326,7 @@ def compute_presence_summary(
     events: list[Presenza],
     period_start: datetime,
     period_end: datetime,
+    count_open: bool = True,
 ) -> tuple[datetime | None, datetime | None, int, datetime | None]:
     if not events:
         return None, None, 0, None
@@ -224,7 +345,7 @@ def compute_presence_summary(
                 total_seconds += int((ev.timestamp_evento - open_entry).total_seconds())
             open_entry = None
 
-    if open_entry:
+    if open_entry and count_open:
         now = datetime.now(timezone.utc)
         cutoff = min(now, period_end)
         if cutoff > open_entry:
@@ -232,6 +353,11 @@ def compute_presence_summary(
     return ingresso, uscita, total_seconds, open_entry
 
 
+def _weak_etag(*parts: object) -> str:
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
 def _safe_name_part(raw: str) -> str:
     allowed = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
     normalized = "".join(ch if ch in allowed else "_" for ch in raw.strip())
@@ -259,7 +385,7 @@ def _fixed_column(value: str, width: int) -> str:
 def build_presence_history_rows(
     db: Session,
     *,
-    user: Utente,
+    user: CurrentUser,
     period_start: datetime,
     period_end: datetime,
     sede_id: uuid.UUID | None = None,
@@ -322,8 +448,13 @@ def build_presence_history_rows(
     return rows
 
 
-@app.get("/health", response_model=HealthOut)
+@app.api_route("/health", methods=["GET", "HEAD"], response_model=HealthOut)
 def health() -> HealthOut:
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        raise HTTPException(status_code=503, detail="Database non raggiungibile") from None
     return HealthOut(status="ok", server_time_utc=datetime.now(timezone.utc), server_tz="UTC")
 
 
@@ -332,7 +463,7 @@ def login(payload: LoginIn, request: Request, db: Session = Depends(get_db)) ->
     user = authenticate_user(db, payload.username, payload.password)
     token = create_access_token(
         subject=str(user.id),
-        extra_claims={"role": user.ruolo.code.value, "groups": user_groups(user)},
+        extra_claims={"role": user.ruolo.code.value, "groups": user_groups(user.ruolo.code)},
     )
     append_audit(
         db,
@@ -459,7 +590,11 @@ def auth_challenge_complete(payload: AuthChallengeCompleteIn, request: Request,
     if not challenge:
         raise HTTPException(status_code=401, detail="Challenge non valida o scaduta")
 
-    user = db.scalar(select(Utente).where(Utente.id == challenge.utente_id, Utente.attivo.is_(True)))
+    user = db.scalar(
+        select(Utente)
+        .options(joinedload(Utente.ruolo))
+        .where(Utente.id == challenge.utente_id, Utente.attivo.is_(True))
+    )
     if not user:
         raise HTTPException(status_code=401, detail="Utente non valido")
 
@@ -494,7 +629,7 @@ def auth_challenge_complete(payload: AuthChallengeCompleteIn, request: Request,
 
     token = create_access_token(
         subject=str(user.id),
-        extra_claims={"role": user.ruolo.code.value, "groups": user_groups(user)},
+        extra_claims={"role": user.ruolo.code.value, "groups": user_groups(user.ruolo.code)},
     )
     append_audit(
         db,
@@ -511,49 +646,49 @@ def auth_challenge_complete(payload: AuthChallengeCompleteIn, request: Request,
 
 
 @app.get("/auth/me", response_model=AuthMeOut)
-def auth_me(user: Utente = Depends(get_current_user)) -> AuthMeOut:
+def auth_me(user: CurrentUser = Depends(get_current_user)) -> AuthMeOut:
     return AuthMeOut(
         id=user.id,
         username=user.username,
-        role=user.ruolo.code,
-        groups=user_groups(user),
+        role=user.role,
+        groups=user_groups(user.role),
         sede_id=user.sede_id,
     )
 
 
 @app.post("/admin/sedi", response_model=SedeOut)
-def create_sede(payload: SedeCreateIn, user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> SedeOut:
+def create_sede(payload: SedeCreateIn, user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> SedeOut:
     nome = payload.nome.strip()
     if not nome:
         raise HTTPException(status_code=400, detail="Nome sede obbligatorio")
 
-    existing = db.scalar(select(Sede).where(Sede.nome == nome))
-    if existing:
+    # Il vincolo unique su nome fa da controllo di esistenza: un solo round-trip, senza corse tra richieste.
+    sede_id = db.scalar(
+        pg_insert(Sede).values(nome=nome, attiva=True).on_conflict_do_nothing(index_elements=["nome"]).returning(Sede.id)
+    )
+    if sede_id is None:
         raise HTTPException(status_code=409, detail="Sede gia esistente")
 
-    sede = Sede(nome=nome, attiva=True)
-    db.add(sede)
-    db.flush()
     append_audit(
         db,
         azione="admin:create_sede",
         entita="sedi",
-        entita_id=str(sede.id),
+        entita_id=str(sede_id),
         esito="OK",
         utente_id=user.id,
     )
     db.commit()
-    return SedeOut(id=sede.id, nome=sede.nome, attiva=sede.attiva)
+    return SedeOut(id=sede_id, nome=nome, attiva=True)
 
 
 @app.get("/admin/sedi", response_model=list[SedeOut])
-def list_sedi(user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> list[SedeOut]:
+def list_sedi(user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> list[SedeOut]:
     rows = db.scalars(select(Sede).order_by(Sede.nome.asc())).all()
     return [SedeOut(id=row.id, nome=row.nome, attiva=row.attiva) for row in rows]
 
 
 @app.delete("/admin/sedi/{sede_id}", response_model=SedeOut)
-def disable_sede(sede_id: uuid.UUID, user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> SedeOut:
+def disable_sede(sede_id: uuid.UUID, user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> SedeOut:
     sede = db.scalar(select(Sede).where(Sede.id == sede_id))
     if not sede:
         raise HTTPException(status_code=404, detail="Sede non trovata")
@@ -568,18 +703,19 @@ def disable_sede(sede_id: uuid.UUID, user: Utente = Depends(get_admin_user), db:
         utente_id=user.id,
     )
     db.commit()
+    invalidate_user_cache()
     return SedeOut(id=sede.id, nome=sede.nome, attiva=sede.attiva)
 
 
 @app.get("/admin/users", response_model=list[UserOut])
-def list_users(user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> list[UserOut]:
-    rows = db.scalars(select(Utente).join(Role).order_by(Utente.username.asc())).all()
+def list_users(user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> list[UserOut]:
+    rows = db.scalars(select(Utente).options(joinedload(Utente.ruolo)).order_by(Utente.username.asc())).all()
     return [
         UserOut(
             id=row.id,
             username=row.username,
             role=row.ruolo.code,
-            groups=user_groups(row),
+            groups=user_groups(row.ruolo.code),
             attivo=row.attivo,
             sede_id=row.sede_id,
         )
@@ -588,7 +724,7 @@ def list_users(user: Utente = Depends(get_admin_user), db: Session = Depends(get
 
 
 @app.post("/admin/users", response_model=UserCreateOut)
-def create_user(payload: UserCreateIn, user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> UserCreateOut:
+def create_user(payload: UserCreateIn, user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> UserCreateOut:
     username = payload.username.strip()
     if not username:
         raise HTTPException(status_code=400, detail="Username obbligatorio")
@@ -596,8 +732,8 @@ def create_user(payload: UserCreateIn, user: Utente = Depends(get_admin_user), d
     if len(payload.key_passphrase.strip()) < 8:
         raise HTTPException(status_code=400, detail="Passphrase chiave troppo corta (minimo 8 caratteri)")
 
-    existing = db.scalar(select(Utente).where(Utente.username == username))
-    if existing:
+    # Controllo economico prima di hash e validazioni: i duplicati rispondono 409 come sempre, senza pbkdf2.
+    if db.scalar(select(Utente.id).where(Utente.username == username)):
         raise HTTPException(status_code=409, detail="Username gia esistente")
 
     role = db.scalar(select(Role).where(Role.code == payload.role))
@@ -609,22 +745,31 @@ def create_user(payload: UserCreateIn, user: Utente = Depends(get_admin_user), d
         if not sede:
             raise HTTPException(status_code=404, detail="Sede non trovata o disattivata")
 
+    # ON CONFLICT resta come guardia per due creazioni concorrenti dello stesso username.
+    new_user_id = db.scalar(
+        pg_insert(Utente)
+        .values(
+            username=username,
+            password_hash=hash_password(secrets.token_urlsafe(32)),
+            ruolo_id=role.id,
+            sede_id=payload.sede_id,
+            attivo=payload.attivo,
+        )
+        .on_conflict_do_nothing(index_elements=["username"])
+        .returning(Utente.id)
+    )
+    if new_user_id is None:
+        raise HTTPException(status_code=409, detail="Username gia esistente")
+
     private_key_pem, public_key_pem, fingerprint = generate_ed25519_keypair()
     key_valid_to = valid_until(payload.key_valid_days)
     encrypted_private_key_pem = encrypt_private_key_pem(private_key_pem, payload.key_passphrase.strip())
 
-    new_user = Utente(
-        username=username,
-        password_hash=hash_password(secrets.token_urlsafe(32)),
-        ruolo_id=role.id,
-        sede_id=payload.sede_id,
-        attivo=payload.attivo,
-    )
-    db.add(new_user)
-    db.flush()
-
+    # Id assegnato qui: la chiave si scrive al commit, senza flush, e la risposta non rilegge la riga.
+    key_id = uuid.uuid4()
     user_key = UserKey(
-        utente_id=new_user.id,
+        id=key_id,
+        utente_id=new_user_id,
         nome=payload.key_name.strip() or "default",
         public_key_pem=public_key_pem,
         fingerprint=fingerprint,
@@ -633,20 +778,19 @@ def create_user(payload: UserCreateIn, user: Utente = Depends(get_admin_user), d
         created_by=user.id,
     )
     db.add(user_key)
-    db.flush()
 
     append_audit(
         db,
         azione="admin:create_user",
         entita="utenti",
-        entita_id=str(new_user.id),
+        entita_id=str(new_user_id),
         esito="OK",
         utente_id=user.id,
         dettagli={
             "role": payload.role.value,
             "attivo": payload.attivo,
             "sede_id": str(payload.sede_id) if payload.sede_id else None,
-            "key_id": str(user_key.id),
+            "key_id": str(key_id),
             "key_fingerprint": fingerprint,
             "key_valid_to": key_valid_to.isoformat(),
         },
@@ -654,21 +798,21 @@ def create_user(payload: UserCreateIn, user: Utente = Depends(get_admin_user), d
     db.commit()
 
     return UserCreateOut(
-        id=new_user.id,
-        username=new_user.username,
+        id=new_user_id,
+        username=username,
         role=payload.role,
         groups=["admin"] if payload.role == UserRole.AMM_CENTRALE else ["educatore"],
-        attivo=new_user.attivo,
-        sede_id=new_user.sede_id,
-        key_id=user_key.id,
+        attivo=payload.attivo,
+        sede_id=payload.sede_id,
+        key_id=key_id,
         key_fingerprint=fingerprint,
         key_expires_at=key_valid_to,
-        key_file_name=f"{new_user.username}-{str(user_key.id)[:8]}.rnk",
+        key_file_name=f"{username}-{str(key_id)[:8]}.rnk",
         key_file_payload=build_key_file_payload(
-            key_id=user_key.id,
-            username=new_user.username,
+            key_id=key_id,
+            username=username,
             role=payload.role.value,
-            sede_id=new_user.sede_id,
+            sede_id=payload.sede_id,
             fingerprint=fingerprint,
             encrypted_private_key_pem=encrypted_private_key_pem,
             valid_to=key_valid_to,
@@ -677,7 +821,7 @@ def create_user(payload: UserCreateIn, user: Utente = Depends(get_admin_user), d
 
 
 @app.get("/admin/users/{user_id}/keys", response_model=list[UserKeyOut])
-def list_user_keys(user_id: uuid.UUID, user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> list[UserKeyOut]:
+def list_user_keys(user_id: uuid.UUID, user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> list[UserKeyOut]:
     target = db.scalar(select(Utente).where(Utente.id == user_id))
     if not target:
         raise HTTPException(status_code=404, detail="Utente non trovato")
@@ -702,10 +846,12 @@ def list_user_keys(user_id: uuid.UUID, user: Utente = Depends(get_admin_user), d
 def issue_user_key(
     user_id: uuid.UUID,
     payload: UserKeyIssueIn,
-    user: Utente = Depends(get_admin_user),
+    user: CurrentUser = Depends(get_admin_user),
     db: Session = Depends(get_db),
 ) -> UserKeyIssueOut:
-    target = db.scalar(select(Utente).where(Utente.id == user_id, Utente.attivo.is_(True)))
+    target = db.scalar(
+        select(Utente).options(joinedload(Utente.ruolo)).where(Utente.id == user_id, Utente.attivo.is_(True))
+    )
     if not target:
         raise HTTPException(status_code=404, detail="Utente non trovato o disattivo")
 
@@ -757,45 +903,53 @@ def revoke_user_key(
     user_id: uuid.UUID,
     key_id: uuid.UUID,
     payload: UserKeyRevokeIn,
-    user: Utente = Depends(get_admin_user),
+    user: CurrentUser = Depends(get_admin_user),
     db: Session = Depends(get_db),
 ) -> UserKeyOut:
-    user_key = db.scalar(select(UserKey).where(UserKey.id == key_id, UserKey.utente_id == user_id))
-    if not user_key:
-        raise HTTPException(status_code=404, detail="Chiave non trovata")
-    if user_key.status == UserKeyStatus.REVOKED:
+    # Revoca condizionata allo stato attivo: la lettura serve solo a distinguere 404 da 409.
+    # RETURNING di colonne, non dell'entita': la risposta non rilegge la riga dopo il commit.
+    revoked = db.execute(
+        update(UserKey)
+        .where(UserKey.id == key_id, UserKey.utente_id == user_id, UserKey.status != UserKeyStatus.REVOKED)
+        .values(
+            status=UserKeyStatus.REVOKED,
+            revoked_at=datetime.now(timezone.utc),
+            revoked_reason=payload.reason.strip()[:255] or "Revoca amministrativa",
+        )
+        .returning(
+            UserKey.id,
+            UserKey.nome,
+            UserKey.fingerprint,
+            UserKey.status,
+            UserKey.valid_from,
+            UserKey.valid_to,
+            UserKey.revoked_at,
+            UserKey.revoked_reason,
+            UserKey.last_used_at,
+        )
+    ).first()
+    if not revoked:
+        exists = db.scalar(select(UserKey.id).where(UserKey.id == key_id, UserKey.utente_id == user_id))
+        if not exists:
+            raise HTTPException(status_code=404, detail="Chiave non trovata")
         raise HTTPException(status_code=409, detail="Chiave gia revocata")
 
-    user_key.status = UserKeyStatus.REVOKED
-    user_key.revoked_at = datetime.now(timezone.utc)
-    user_key.revoked_reason = payload.reason.strip()[:255] or "Revoca amministrativa"
-
     append_audit(
         db,
         azione="admin:revoke_user_key",
         entita="user_keys",
-        entita_id=str(user_key.id),
+        entita_id=str(revoked.id),
         esito="OK",
         utente_id=user.id,
-        dettagli={"target_user_id": str(user_id), "reason": user_key.revoked_reason},
+        dettagli={"target_user_id": str(user_id), "reason": revoked.revoked_reason},
     )
     db.commit()
-
-    return UserKeyOut(
-        id=user_key.id,
-        nome=user_key.nome,
-        fingerprint=user_key.fingerprint,
-        status=user_key.status,
-        valid_from=user_key.valid_from,
-        valid_to=user_key.valid_to,
-        revoked_at=user_key.revoked_at,
-        revoked_reason=user_key.revoked_reason,
-        last_used_at=user_key.last_used_at,
-    )
+    invalidate_user_cache(user_id)
+    return UserKeyOut(**revoked._mapping)
 
 
 @app.post("/admin/bambini", response_model=BambinoOut)
-def create_bambino(payload: BambinoCreateIn, user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> BambinoOut:
+def create_bambino(payload: BambinoCreateIn, user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> BambinoOut:
     sede = db.scalar(select(Sede).where(Sede.id == payload.sede_id, Sede.attiva.is_(True)))
     if not sede:
         raise HTTPException(status_code=404, detail="Sede non trovata o disattivata")
@@ -805,36 +959,38 @@ def create_bambino(payload: BambinoCreateIn, user: Utente = Depends(get_admin_us
     if not nome or not cognome:
         raise HTTPException(status_code=400, detail="Nome e cognome obbligatori")
 
+    bambino_id = uuid.uuid4()
     bambino = Bambino(
+        id=bambino_id,
         sede_id=payload.sede_id,
         nome=nome,
         cognome=cognome,
         attivo=payload.attivo,
     )
     db.add(bambino)
-    db.flush()
     append_audit(
         db,
         azione="admin:create_bambino",
         entita="bambini",
-        entita_id=str(bambino.id),
+        entita_id=str(bambino_id),
         esito="OK",
         utente_id=user.id,
         dettagli={"sede_id": str(payload.sede_id)},
     )
     db.commit()
+    # Valori locali: dopo il commit l'oggetto e' scaduto e leggerlo costerebbe un'altra SELECT.
     return BambinoOut(
-        id=bambino.id,
-        nome=bambino.nome,
-        cognome=bambino.cognome,
-        sede_id=bambino.sede_id,
-        attivo=bambino.attivo,
+        id=bambino_id,
+        nome=nome,
+        cognome=cognome,
+        sede_id=payload.sede_id,
+        attivo=payload.attivo,
     )
 
 
 @app.get("/admin/bambini", response_model=list[BambinoOut])
 def list_admin_bambini(
-    user: Utente = Depends(get_admin_user),
+    user: CurrentUser = Depends(get_admin_user),
     db: Session = Depends(get_db),
     sede_id: uuid.UUID | None = None,
     include_inactive: bool = False,
@@ -861,7 +1017,7 @@ def list_admin_bambini(
 @app.delete("/admin/bambini/{bambino_id}", response_model=BambinoOut)
 def delete_bambino(
     bambino_id: uuid.UUID,
-    user: Utente = Depends(get_admin_user),
+    user: CurrentUser = Depends(get_admin_user),
     db: Session = Depends(get_db),
 ) -> BambinoOut:
     bambino = db.scalar(select(Bambino).where(Bambino.id == bambino_id))
@@ -890,7 +1046,7 @@ def delete_bambino(
 
 
 @app.post("/admin/devices", response_model=DeviceProvisionOut)
-def create_device(payload: DeviceCreateIn, user: Utente = Depends(get_admin_user), db: Session = Depends(get_db)) -> DeviceProvisionOut:
+def create_device(payload: DeviceCreateIn, user: CurrentUser = Depends(get_admin_user), db: Session = Depends(get_db)) -> DeviceProvisionOut:
     sede = db.scalar(select(Sede).where(Sede.id == payload.sede_id, Sede.attiva.is_(True)))
     if not sede:
         raise HTTPException(status_code=404, detail="Sede non trovata o disattivata")
@@ -910,7 +1066,7 @@ def create_device(payload: DeviceCreateIn, user: Utente = Depends(get_admin_user
 
     activation = DeviceActivation(
         device_id=device.id,
-        code_hash=hash_password(activation_code_normalized),
+        code_lookup=activation_code_lookup(activation_code_normalized),
         expires_at=expires_at,
         claimed_at=None,
         created_by=user.id,
@@ -944,18 +1100,29 @@ def claim_device(payload: DeviceClaimIn, request: Request, db: Session = Depends
         raise HTTPException(status_code=400, detail="Activation code non valido")
 
     now = datetime.now(timezone.utc)
+    lookup = activation_code_lookup(submitted)
+    # Attivazioni create prima di code_lookup (NULL) restano verificabili finche' non scadono.
     activations = db.scalars(
         select(DeviceActivation).where(
+            or_(
+                DeviceActivation.code_lookup == lookup,
+                DeviceActivation.code_lookup.is_(None),
+            ),
             DeviceActivation.claimed_at.is_(None),
             DeviceActivation.expires_at > now,
         )
     ).all()
 
+    # La query filtra gia' su code_lookup: tornano solo la riga giusta e le attivazioni legacy senza code_lookup.
+    # Il ciclo serve a queste ultime (hash lento, nessuna uscita anticipata); compare_digest e' difesa in profondita'.
     match: DeviceActivation | None = None
     for activation in activations:
-        if verify_password(submitted, activation.code_hash):
+        if activation.code_lookup is not None:
+            ok = hmac.compare_digest(activation.code_lookup, lookup)
+        else:
+            ok = activation.code_hash is not None and verify_password(submitted, activation.code_hash)
+        if ok and match is None:
             match = activation
-            break
 
     if not match:
         raise HTTPException(status_code=401, detail="Activation code non valido o scaduto")
@@ -989,7 +1156,7 @@ def claim_device(payload: DeviceClaimIn, request: Request, db: Session = Depends
 
 
 @app.post("/devices/register", response_model=DeviceRegisterOut)
-def register_device(payload: DeviceRegisterIn, user: Utente = Depends(get_current_user), db: Session = Depends(get_db)) -> DeviceRegisterOut:
+def register_device(payload: DeviceRegisterIn, user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)) -> DeviceRegisterOut:
     if not user.sede_id:
         raise HTTPException(status_code=400, detail="Utente non associato a una sede")
 
@@ -1055,7 +1222,7 @@ def register_device(payload: DeviceRegisterIn, user: Utente = Depends(get_curren
 
 
 @app.post("/presenze/check-in", response_model=PresenceEventOut)
-def check_in(payload: PresenceEventIn, user: Utente = Depends(get_current_user), db: Session = Depends(get_db)) -> PresenceEventOut:
+def check_in(payload: PresenceEventIn, user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)) -> PresenceEventOut:
     presenza = create_presence_event(
         db,
         tipo=PresenceEventType.ENTRATA,
@@ -1070,7 +1237,7 @@ def check_in(payload: PresenceEventIn, user: Utente = Depends(get_current_user),
 
 
 @app.post("/presenze/check-out", response_model=PresenceEventOut)
-def check_out(payload: PresenceEventIn, user: Utente = Depends(get_current_user), db: Session = Depends(get_db)) -> PresenceEventOut:
+def check_out(payload: PresenceEventIn, user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)) -> PresenceEventOut:
     presenza = create_presence_event(
         db,
         tipo=PresenceEventType.USCITA,
@@ -1085,32 +1252,14 @@ def check_out(payload: PresenceEventIn, user: Utente = Depends(get_current_user)
 
 
 @app.post("/sync", response_model=SyncOut)
-def sync(payload: SyncIn, user: Utente = Depends(get_current_user), db: Session = Depends(get_db)) -> SyncOut:
-    accepted = 0
-    skipped = 0
-
-    for event in payload.eventi:
-        try:
-            tipo_evento = event.tipo_evento or PresenceEventType.ENTRATA
-            create_presence_event(
-                db,
-                tipo=tipo_evento,
-                bambino_id=event.bambino_id,
-                dispositivo_id=event.dispositivo_id,
-                client_event_id=event.client_event_id,
-                timestamp_evento=event.timestamp_evento,
-                creato_da=user.id,
-            )
-            accepted += 1
-        except HTTPException:
-            skipped += 1
-
+def sync(payload: SyncIn, user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)) -> SyncOut:
+    accepted, skipped = create_presence_events(db, payload.eventi, user.id)
     db.commit()
     return SyncOut(accepted=accepted, skipped=skipped)
 
 
 @app.get("/devices/{device_id}", response_model=DeviceProfileOut)
-def get_device_profile(device_id: uuid.UUID, user: Utente = Depends(get_current_user), db: Session = Depends(get_db)) -> DeviceProfileOut:
+def get_device_profile(device_id: uuid.UUID, user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)) -> DeviceProfileOut:
     row = db.execute(
         select(
             Dispositivo.id,
@@ -1138,7 +1287,7 @@ def list_bambini(
     dispositivo_id: uuid.UUID | None = None,
     q: str | None = None,
     limit: int = 100,
-    user: Utente = Depends(get_current_user),
+    user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> list[BambinoOut]:
     limit = min(max(limit, 1), 500)
@@ -1153,7 +1302,7 @@ def list_bambini(
                 raise HTTPException(status_code=403, detail="Sede non autorizzata per questo utente")
             target_sede_ids = {device.sede_id}
 
-    stmt = select(Bambino).where(
+    stmt = select(Bambino.id, Bambino.nome, Bambino.cognome, Bambino.sede_id, Bambino.attivo).where(
         Bambino.sede_id.in_(list(target_sede_ids)),
         Bambino.attivo.is_(True),
     )
@@ -1161,9 +1310,10 @@ def list_bambini(
         q_norm = f"%{q.strip()}%"
         stmt = stmt.where((Bambino.nome.ilike(q_norm)) | (Bambino.cognome.ilike(q_norm)))
 
-    rows = db.scalars(stmt.order_by(Bambino.cognome.asc(), Bambino.nome.asc()).limit(limit)).all()
+    # Solo colonne e model_construct: niente oggetti ORM ne' validazione per righe gia' valide a DB.
+    rows = db.execute(stmt.order_by(Bambino.cognome.asc(), Bambino.nome.asc()).limit(limit)).all()
     return [
-        BambinoOut(
+        BambinoOut.model_construct(
             id=row.id,
             nome=row.nome,
             cognome=row.cognome,
@@ -1175,7 +1325,7 @@ def list_bambini(
 
 
 @app.get("/catalog/sedi-accessibili", response_model=list[SedeOut])
-def list_accessible_sedi(user: Utente = Depends(get_current_user), db: Session = Depends(get_db)) -> list[SedeOut]:
+def list_accessible_sedi(user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)) -> list[SedeOut]:
     sedi = allowed_sedi_for_user(db, user)
     return [SedeOut(id=row.id, nome=row.nome, attiva=row.attiva) for row in sedi]
 
@@ -1184,7 +1334,7 @@ def list_accessible_sedi(user: Utente = Depends(get_current_user), db: Session =
 def list_accessible_iscritti(
     sede_id: uuid.UUID | None = None,
     include_inactive: bool = False,
-    user: Utente = Depends(get_current_user),
+    user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> list[BambinoOut]:
     sedi = allowed_sedi_for_user(db, user)
@@ -1212,11 +1362,13 @@ def list_accessible_iscritti(
 
 @app.get("/catalog/presenze-stato", response_model=list[BambinoPresenceStateOut])
 def list_bambini_presence_state(
+    request: Request,
+    response: Response,
     dispositivo_id: uuid.UUID | None = None,
     limit: int = 200,
-    user: Utente = Depends(get_current_user),
+    user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db),
-) -> list[BambinoPresenceStateOut]:
+) -> list[BambinoPresenceStateOut] | Response:
     limit = min(max(limit, 1), 500)
     allowed_sedi = allowed_sedi_for_user(db, user)
     allowed_sede_ids = {row.id for row in allowed_sedi}
@@ -1236,6 +1388,32 @@ def list_bambini_presence_state(
     bambini = db.scalars(stmt.order_by(Bambino.nome.asc(), Bambino.cognome.asc()).limit(limit)).all()
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     today_end = today_start + timedelta(days=1)
+
+    # ETag da una sola query aggregata, prima delle letture per bambino: con 304 non si fa altro lavoro.
+    # Le presenze sono solo inserite, quindi numero e ultimo timestamp per bambino bastano a rilevare modifiche.
+    event_stats = {
+        row.bambino_id: (row.eventi, row.ultimo)
+        for row in db.execute(
+            select(
+                Presenza.bambino_id,
+                func.count().label("eventi"),
+                func.max(Presenza.timestamp_evento).label("ultimo"),
+            )
+            .where(Presenza.bambino_id.in_([bambino.id for bambino in bambini]))
+            .group_by(Presenza.bambino_id)
+        )
+    }
+    etag = _weak_etag(
+        today_start,
+        *(
+            (bambino.id, bambino.nome, bambino.cognome, bambino.sede_id, event_stats.get(bambino.id))
+            for bambino in bambini
+        ),
+    )
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+
     result: list[BambinoPresenceStateOut] = []
     for bambino in bambini:
         bambino_sede_id = bambino.sede_id
@@ -1256,8 +1434,10 @@ def list_bambini_presence_state(
             )
             .order_by(Presenza.timestamp_evento.asc())
         ).all()
+        # Solo le permanenze chiuse: la quota aperta la aggiunge il client da entrata_aperta_da,
+        # cosi' la risposta non dipende dall'orario della richiesta e l'ETag resta valido.
         ultimo_ingresso, ultima_uscita, tempo_totale_secondi, _ = compute_presence_summary(
-            events_today, today_start, today_end
+            events_today, today_start, today_end, count_open=False
         )
         result.append(
             BambinoPresenceStateOut(
@@ -1273,6 +1453,8 @@ def list_bambini_presence_state(
                 tempo_totale_secondi=tempo_totale_secondi,
             )
         )
+
+    response.headers.update(cache_headers)
     return result
 
 
@@ -1282,7 +1464,7 @@ def list_presence_history(
     periodo: str,
     sede_id: uuid.UUID | None = None,
     bambino_id: uuid.UUID | None = None,
-    user: Utente = Depends(get_current_user),
+    user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> PresenceHistoryOut:
     period_start, period_end = parse_period_bounds(unita, periodo)
@@ -1309,7 +1491,7 @@ def export_presence_history_pdf(
     periodo: str,
     sede_id: uuid.UUID | None = None,
     bambino_id: uuid.UUID | None = None,
-    user: Utente = Depends(get_current_user),
+    user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> Response:
     period_start, period_end = parse_period_bounds(unita, periodo)
@@ -1437,10 +1619,48 @@ def export_presence_history_pdf(
     )
 
 
+AUDIT_PAGE_SIZE = 100
+
+
 @app.get("/audit")
-def list_audit(user: Utente = Depends(get_current_user), db: Session = Depends(get_db)):
-    rows = db.scalars(select(AuditLog).order_by(AuditLog.timestamp.desc()).limit(100)).all()
-    return [
+def list_audit(
+    before: str | None = None,
+    dettagli: bool = False,
+    user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Paginazione a chiave su (timestamp, id): la pagina successiva si chiede con before=X-Next-Before.
+    columns = [
+        AuditLog.id,
+        AuditLog.timestamp,
+        AuditLog.azione,
+        AuditLog.entita,
+        AuditLog.entita_id,
+        AuditLog.esito,
+        AuditLog.utente_id,
+        AuditLog.dispositivo_id,
+    ]
+    if dettagli:
+        columns.append(AuditLog.dettagli_json)
+    query = select(*columns).order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(AUDIT_PAGE_SIZE)
+    if before is not None:
+        # Cursore "timestamp,id"; il solo timestamp resta accettato per i client meno recenti.
+        before_ts, _, before_id = before.partition(",")
+        try:
+            cursor_ts = datetime.fromisoformat(before_ts)
+            cursor_id = uuid.UUID(before_id) if before_id else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursore audit non valido") from None
+        if cursor_id is None:
+            query = query.where(AuditLog.timestamp < cursor_ts)
+        else:
+            query = query.where(tuple_(AuditLog.timestamp, AuditLog.id) < tuple_(cursor_ts, cursor_id))
+    rows = db.execute(query).all()
+    headers = (
+        {"X-Next-Before": f"{rows[-1].timestamp.isoformat()},{rows[-1].id}"} if len(rows) == AUDIT_PAGE_SIZE else None
+    )
+    # Risposta costruita qui: orjson serializza direttamente, senza il passaggio per jsonable_encoder.
+    content = [
         {
             "id": str(r.id),
             "timestamp": r.timestamp,
@@ -1450,7 +1670,8 @@ def list_audit(user: Utente = Depends(get_current_user), db: Session = Depends(g
             "esito": r.esito,
             "utente_id": str(r.utente_id) if r.utente_id else None,
             "dispositivo_id": str(r.dispositivo_id) if r.dispositivo_id else None,
-            "dettagli": r.dettagli_json,
+            "dettagli": r.dettagli_json if dettagli else None,
         }
         for r in rows
     ]
+    return ORJSONResponse(content=content, headers=headers)
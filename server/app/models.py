@@ -1,14 +1,24 @@
 import enum
+import os
+import time
 import uuid
 from datetime import datetime
 
-from sqlalchemy import JSON, Boolean, DateTime, Enum, ForeignKey, String, Text, UniqueConstraint
+from sqlalchemy import JSON, Boolean, DateTime, Enum, ForeignKey, Index, String, Text, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db import Base
 
 
+def uuid7() -> uuid.UUID:
+    # UUIDv7 (RFC 9562): millisecondi Unix nei 48 bit alti, cosi' le righe nuove finiscono in coda all'indice.
+    value = ((time.time_ns() // 1_000_000) << 80) | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value)
+
+
 class UserRole(str, enum.Enum):
     AMM_CENTRALE = "AMM_CENTRALE"
     EDUCATORE = "EDUCATORE"
@@ -35,6 +45,7 @@ class Sede(Base):
 
 class Bambino(Base):
     __tablename__ = "bambini"
+    __table_args__ = (Index("ix_bambini_sede_attivo", "sede_id", "attivo"),)
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     sede_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("sedi.id"), nullable=False)
@@ -101,7 +112,10 @@ class DeviceActivation(Base):
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     device_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("dispositivi.id"), nullable=False)
-    code_hash: Mapped[str] = mapped_column(String(255), nullable=False)
+    # Solo attivazioni legacy: le nuove hanno soltanto code_lookup.
+    code_hash: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # HMAC del codice normalizzato: il claim cerca per uguaglianza invece di verificare ogni hash.
+    code_lookup: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
     expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     claimed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     created_by: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("utenti.id"), nullable=False)
@@ -112,7 +126,7 @@ class Presenza(Base):
     __tablename__ = "presenze"
     __table_args__ = (UniqueConstraint("client_event_id", name="uq_client_event_id"),)
 
-    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     bambino_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("bambini.id"), nullable=False)
     sede_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("sedi.id"), nullable=False)
     dispositivo_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("dispositivi.id"), nullable=False)
@@ -124,10 +138,16 @@ class Presenza(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
 
 
+# Ultimo evento per bambino/sede: lettura con una sola discesa dell'indice (anche per DISTINCT ON del sync).
+Index("ix_presenze_child_sede_ts", Presenza.bambino_id, Presenza.sede_id, Presenza.timestamp_evento.desc())
+
+
 class AuditLog(Base):
     __tablename__ = "audit_log"
+    # Chiave di paginazione di /audit: timestamp non e' univoco, l'id fa da spareggio.
+    __table_args__ = (Index("ix_audit_log_timestamp_id", "timestamp", "id"),)
 
-    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
     utente_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("utenti.id"), nullable=True)
     dispositivo_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("dispositivi.id"), nullable=True)
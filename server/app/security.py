@@ -1,4 +1,6 @@
-from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+from datetime import datetime, timezone
 
 from jose import jwt
 from passlib.context import CryptContext
@@ -17,9 +19,13 @@ def verify_password(plain_password: str, password_hash: str) -> bool:
     return pwd_context.verify(plain_password, password_hash)
 
 
+def activation_code_lookup(normalized_code: str) -> str:
+    return hmac.new(settings.activation_code_key, normalized_code.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
 def create_access_token(subject: str, extra_claims: dict | None = None) -> str:
     now = datetime.now(timezone.utc)
-    expire = now + timedelta(minutes=settings.access_token_expire_minutes)
+    expire = now + settings.access_token_expire
     to_encode = {"sub": subject, "iat": int(now.timestamp()), "exp": int(expire.timestamp())}
     if extra_claims:
         to_encode.update(extra_claims)